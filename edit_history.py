@@ -0,0 +1,323 @@
+from abc import ABC, abstractmethod
+from collections import deque
+import zlib
+import numpy as np
+
+class EditCommand(ABC):
+    """
+    一個可以復原的操作。操作本身由呼叫端先執行，再把對應的command交給 EditHistory.push
+
+    undo / redo 的參數 editor 是 MainFrame，command 透過它提供的函式修改狀態。
+    子類別一定要實作 undo 和 redo，否則建立時就會失敗
+    """
+
+    @abstractmethod
+    def undo(self, editor):
+        """
+        復原這個操作
+        """
+
+    @abstractmethod
+    def redo(self, editor):
+        """
+        重做這個操作
+        """
+
+    def nbytes(self) -> int:
+        """
+        這個command額外佔用的記憶體（估計值）
+        """
+        return 64
+
+    def compress(self):
+        """
+        盡量減少佔用的記憶體，預設不做任何事
+        """
+        pass
+
+    pass # end of class EditCommand
+
+
+class AddPointCommand(EditCommand):
+    """
+    在多邊形中新增一點
+    """
+    def __init__(self, x: int, y: int):
+        self.X, self.Y = x, y
+
+    def undo(self, editor):
+        editor.__polygon__.popPoint()
+
+    def redo(self, editor):
+        editor.__polygon__.addPoint(self.X, self.Y)
+
+
+class PopPointCommand(EditCommand):
+    """
+    刪掉多邊形的最後一點
+    """
+    def __init__(self, x: int, y: int):
+        self.X, self.Y = x, y
+
+    def undo(self, editor):
+        editor.__polygon__.addPoint(self.X, self.Y)
+
+    def redo(self, editor):
+        editor.__polygon__.popPoint()
+
+
+class ClearPointsCommand(EditCommand):
+    """
+    清空多邊形，POINTS 為清空前所有的點（n * 2）
+    """
+    def __init__(self, points: np.ndarray):
+        self.POINTS = points
+
+    def undo(self, editor):
+        for x, y in self.POINTS.tolist():
+            editor.__polygon__.addPoint(x, y)
+
+    def redo(self, editor):
+        editor.__polygon__.clear()
+
+    def nbytes(self) -> int:
+        return 64 + self.POINTS.nbytes
+
+
+class ReplacePointsCommand(EditCommand):
+    """
+    將多邊形的所有點換成另一組點（例如自動產生的多邊形），OLD_POINTS / NEW_POINTS 皆為 n * 2
+    """
+    def __init__(self, old_points: np.ndarray, new_points: np.ndarray):
+        self.OLD_POINTS, self.NEW_POINTS = old_points, new_points
+
+    def undo(self, editor):
+        editor.__polygon__.clear()
+        for x, y in self.OLD_POINTS.tolist():
+            editor.__polygon__.addPoint(x, y)
+
+    def redo(self, editor):
+        editor.__polygon__.clear()
+        for x, y in self.NEW_POINTS.tolist():
+            editor.__polygon__.addPoint(x, y)
+
+    def nbytes(self) -> int:
+        return 64 + self.OLD_POINTS.nbytes + self.NEW_POINTS.nbytes
+
+
+class MaskCommand(EditCommand):
+    """
+    新增／刪除mask的共同部份
+
+    mask_data 以reference保存，不會複製。只有當mask不在database中（OWNED為True）時才算進記憶體用量，
+    此時可以被壓縮：將 "Mask" 欄位換成zlib壓縮後的bytes，要放回database前再解壓縮
+    """
+    IDX: int                # mask在database中的位置
+    MASK_DATA: dict         # 和database中同一個dict
+    OWNED: bool             # mask是否只存在於這個command中（不在database裡）
+    __packed__: tuple[tuple[int, int], bytes] | None # 壓縮後的 (shape, bytes)，沒壓縮時為None
+
+    def __init__(self, idx: int, mask_data: dict, owned: bool):
+        self.IDX = idx
+        self.MASK_DATA = mask_data
+        self.OWNED = owned
+        self.__packed__ = None
+
+    def nbytes(self) -> int:
+        if not self.OWNED:
+            return 64
+        if self.__packed__ is not None:
+            return 64 + len(self.__packed__[1])
+        # list of list of int：每個元素是一個8 bytes的pointer（小整數本身是共用的），每一列另有list的overhead
+        mask = self.MASK_DATA["Mask"]
+        return 64 + len(mask) * 56 + sum(len(row) for row in mask) * 8
+
+    def compress(self):
+        if not self.OWNED or self.__packed__ is not None:
+            return
+        mask = np.array(self.MASK_DATA["Mask"], dtype=np.uint8)
+        self.__packed__ = (mask.shape, zlib.compress(mask.tobytes(), 1))
+        self.MASK_DATA["Mask"] = None
+
+    def __insert__(self, editor):
+        """
+        解壓縮（如果需要），並將mask放回database
+        """
+        if self.__packed__ is not None:
+            shape, data = self.__packed__
+            self.MASK_DATA["Mask"] = np.frombuffer(zlib.decompress(data), np.uint8).reshape(shape).tolist()
+            self.__packed__ = None
+        editor.__insert_mask__(self.IDX, self.MASK_DATA)
+        self.OWNED = False
+
+    def __remove__(self, editor):
+        """
+        將mask從database移除，之後由這個command保管
+        """
+        editor.__remove_mask__(self.IDX)
+        self.OWNED = True
+
+
+class AddMaskCommand(MaskCommand):
+    """
+    新增一個mask
+    """
+    def __init__(self, idx: int, mask_data: dict):
+        MaskCommand.__init__(self, idx, mask_data, owned=False)
+
+    def undo(self, editor):
+        self.__remove__(editor)
+
+    def redo(self, editor):
+        self.__insert__(editor)
+
+
+class DeleteMaskCommand(MaskCommand):
+    """
+    刪除一個mask
+    """
+    def __init__(self, idx: int, mask_data: dict):
+        MaskCommand.__init__(self, idx, mask_data, owned=True)
+
+    def undo(self, editor):
+        self.__insert__(editor)
+
+    def redo(self, editor):
+        self.__remove__(editor)
+
+
+class SetLabelCommand(EditCommand):
+    """
+    更改mask的標籤
+    """
+    def __init__(self, idx: int, old_label: str, new_label: str):
+        self.IDX = idx
+        self.OLD_LABEL, self.NEW_LABEL = old_label, new_label
+
+    def undo(self, editor):
+        editor.__set_mask_label__(self.IDX, self.OLD_LABEL)
+
+    def redo(self, editor):
+        editor.__set_mask_label__(self.IDX, self.NEW_LABEL)
+
+
+class EditHistory:
+    """
+    undo / redo 的堆疊，總記憶體用量不超過 MAX_BYTES
+
+    超過上限時，先從最舊的command開始壓縮，還是不夠的話再丟掉最舊的undo（最後才丟最遠的redo）
+    """
+    MAX_BYTES: int                      # 記憶體上限
+    __undo__: deque[EditCommand]        # 越後面越新
+    __redo__: list[EditCommand]         # 越後面越接近現在
+    __nbytes__: int                     # 所有command的 nbytes 總和
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        初始化
+
+        Args:
+            max_bytes: 記憶體上限，預設64MB
+        """
+        self.MAX_BYTES = max_bytes
+        self.__undo__ = deque()
+        self.__redo__ = list()
+        self.__nbytes__ = 0
+
+    def push(self, cmd: EditCommand):
+        """
+        記錄一個已經執行過的操作，並清空redo
+        """
+        for old in self.__redo__:
+            self.__nbytes__ -= old.nbytes()
+        self.__redo__.clear()
+
+        self.__undo__.append(cmd)
+        self.__nbytes__ += cmd.nbytes()
+        self.__enforce__()
+
+    def undo(self, editor) -> bool:
+        """
+        復原最近一次的操作
+
+        Return:
+            是否有東西可以復原
+        """
+        if len(self.__undo__) == 0:
+            return False
+
+        cmd = self.__undo__.pop()
+        self.__nbytes__ -= cmd.nbytes()
+        cmd.undo(editor)
+        self.__redo__.append(cmd)
+        self.__nbytes__ += cmd.nbytes()
+        self.__enforce__()
+        return True
+
+    def redo(self, editor) -> bool:
+        """
+        重做最近一次被復原的操作
+
+        Return:
+            是否有東西可以重做
+        """
+        if len(self.__redo__) == 0:
+            return False
+
+        cmd = self.__redo__.pop()
+        self.__nbytes__ -= cmd.nbytes()
+        cmd.redo(editor)
+        self.__undo__.append(cmd)
+        self.__nbytes__ += cmd.nbytes()
+        self.__enforce__()
+        return True
+
+    def clear(self):
+        """
+        清空所有記錄（例如重新載入json之後，舊的記錄就沒有意義了）
+        """
+        self.__undo__.clear()
+        self.__redo__.clear()
+        self.__nbytes__ = 0
+
+    def set_max_bytes(self, max_bytes: int):
+        """
+        更改記憶體上限，若目前已超出上限則立即處理
+        """
+        self.MAX_BYTES = max_bytes
+        self.__enforce__()
+
+    def nbytes(self) -> int:
+        """
+        目前所有command佔用的記憶體（估計值）
+        """
+        return self.__nbytes__
+
+    def shrink_to(self, nbytes: int):
+        """
+        依序壓縮、丟掉最舊的undo、丟掉最遠的redo，直到佔用不超過nbytes（MAX_BYTES不變）
+        """
+        if self.__nbytes__ <= nbytes:
+            return
+
+        # 壓縮：從最舊的undo開始，再來是最遠的redo
+        for cmd in list(self.__undo__) + self.__redo__:
+            if self.__nbytes__ <= nbytes:
+                return
+            before = cmd.nbytes()
+            cmd.compress()
+            self.__nbytes__ += cmd.nbytes() - before
+
+        while self.__nbytes__ > nbytes and len(self.__undo__) != 0:
+            self.__nbytes__ -= self.__undo__.popleft().nbytes()
+
+        while self.__nbytes__ > nbytes and len(self.__redo__) != 0:
+            self.__nbytes__ -= self.__redo__.pop(0).nbytes()
+
+    def __enforce__(self):
+        """
+        若超出 MAX_BYTES，依序壓縮、丟掉最舊的undo、丟掉最遠的redo
+        """
+        self.shrink_to(self.MAX_BYTES)
+
+    pass # end of class EditHistory
@@ -0,0 +1,220 @@
+import tkinter as tk
+from tkinter import messagebox
+from types import SimpleNamespace
+from typing import Callable
+import argparse
+import json
+import platform
+import time
+import cv2
+import numpy as np
+
+class EventRecorder:
+    """
+    將互動事件（平移、縮放、點擊、新增／刪除mask、選擇mask）記錄到檔案，之後可以用 `replay` 重播並量測延遲
+
+    檔案格式為 JSON Lines：第一行是 { "image": 圖片路徑 }，之後每一行是一個事件
+    ```
+    { "t": 距離開始的秒數, "name": 事件名稱, "event": 是否有tk.Event, "x": ..., "y": ..., "delta": ...,
+      "w": widget寬, "h": widget高, "sel": MASK_LIST選中的項目, "label": 標籤, "masks": 事件前mask數, "masks_after": 事件後mask數,
+      "latency": 處理時間（秒） }
+    ```
+    """
+    LATENCY: dict[str, list[float]]  # 每種事件的處理時間（秒）
+    __out__: object                  # 輸出的檔案
+    __start__: float                 # 開始記錄的時間
+
+    def __init__(self, path: str, image: str):
+        """
+        初始化，並寫入檔頭
+
+        Args:
+            path: 輸出檔案的路徑
+            image: 正在標記的圖片路徑，重播時會開啟同一張圖
+        """
+        self.LATENCY = dict()
+        self.__out__ = open(path, 'wt')
+        self.__out__.write(json.dumps({ "image": image }) + '\n')
+        self.__start__ = time.perf_counter()
+
+    def wrap(self, name: str, handler: Callable, state: Callable[[], dict]) -> Callable:
+        """
+        包裝handler，使得每次被呼叫時都會記錄事件
+
+        Args:
+            name: 事件名稱，重播時用來找出對應的handler
+            handler: 原本的handler，可以有一個tk.Event參數，也可以沒有參數
+            state: 回傳重播時需要還原的狀態（例如選中的mask），呼叫前後各取一次
+        """
+        def wrapped(*args):
+            event = args[0] if len(args) != 0 else None
+            record = { "t": time.perf_counter() - self.__start__, "name": name, "event": event is not None }
+            if event is not None:
+                record.update(x=event.x, y=event.y, delta=getattr(event, 'delta', 0))
+            record.update(state())
+
+            t0 = time.perf_counter()
+            result = handler(*args)
+            latency = time.perf_counter() - t0
+
+            record["masks_after"] = state()["masks"]
+            record["latency"] = latency
+            self.LATENCY.setdefault(name, []).append(latency)
+
+            self.__out__.write(json.dumps(record) + '\n')
+            self.__out__.flush()
+            return result
+
+        return wrapped
+
+    def close(self):
+        """
+        關閉輸出的檔案
+        """
+        self.__out__.close()
+
+    pass # end of class EventRecorder
+
+
+def load_session(path: str) -> tuple[str, list[dict]]:
+    """
+    讀取 EventRecorder 輸出的檔案
+
+    Return:
+        (圖片路徑, 事件列表)
+    """
+    with open(path, 'rt') as f:
+        lines = [json.loads(line) for line in f if line.strip() != ""]
+    return lines[0]["image"], lines[1:]
+
+
+__replaying__: dict | None = None  # 正在重播的事件，confirm_as_recorded 依它回答
+
+
+def confirm_as_recorded(*args, **kwargs) -> bool:
+    """
+    取代 messagebox.askyesno：依正在重播的事件在記錄時的結果回答（mask數有減少代表當時按了「是」）
+    """
+    e = __replaying__ or dict()
+    return e.get("masks_after", 0) < e.get("masks", 0)
+
+
+def replay(frame, events: list[dict]) -> dict[str, list[float]]:
+    """
+    在MainFrame上依序重播事件，直接呼叫對應的handler，並量測每個事件的處理時間（含 update_idletasks）
+
+    刪除mask的確認對話框要由呼叫端先換成 confirm_as_recorded，才會依記錄時的結果回答
+
+    Args:
+        frame: 已經顯示出來的MainFrame
+        events: load_session 讀出的事件
+
+    Return:
+        事件名稱 -> 處理時間（秒）的列表
+    """
+    global __replaying__
+    root = frame.winfo_toplevel()
+    handlers = frame.event_handlers()
+    latency = dict()
+
+    for e in events:
+        # 還原記錄時的狀態
+        if "sel" in e:
+            frame.__control__.MASK_LIST.selection_clear(0, tk.END)
+            for i in e["sel"]:
+                frame.__control__.MASK_LIST.selection_set(i)
+        if "label" in e:
+            frame.__control__.LABEL_COMBO.set(e["label"])
+        __replaying__ = e
+
+        handler = handlers[e["name"]]
+        t0 = time.perf_counter()
+        if e["event"]:
+            handler(SimpleNamespace(x=e["x"], y=e["y"], delta=e["delta"]))
+        else:
+            handler()
+        root.update_idletasks()
+        latency.setdefault(e["name"], []).append(time.perf_counter() - t0)
+
+    __replaying__ = None
+
+    return latency
+
+
+def reset_session(frame):
+    """
+    將MainFrame還原成剛開啟圖片時的狀態（重新讀取json、清空多邊形和復原記錄、顯示整張圖），
+    讓每次重播都從和記錄時一樣的狀態開始
+    """
+    frame.reload_mask()
+    frame.__polygon__.clear()
+    frame.__history__.clear()
+    frame.__img_edit__.change_viewport((0, 0, *frame.__img_edit__.IMG_SIZE))
+    frame.winfo_toplevel().update_idletasks()
+
+
+def summarize(latency: dict[str, list[float]]) -> dict:
+    """
+    將處理時間整理成分佈（毫秒），並附上環境資訊，方便比較不同機器和版本
+    """
+    report = {
+        "platform": platform.platform(), "python": platform.python_version(), "opencv": cv2.__version__, "events": dict()
+    }
+    for name, values in latency.items():
+        ms = np.array(values) * 1000
+        report["events"][name] = {
+            "count": len(values), "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)), "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max()),
+        }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="重播 EventRecorder 記錄的事件，並輸出每種事件的延遲分佈。沒有螢幕的環境可以用 xvfb-run 執行")
+    parser.add_argument("session", help="記錄檔（setting.json 中 record_events 指定的路徑）")
+    parser.add_argument("--image", help="改用這張圖片重播，預設使用記錄檔中的圖片")
+    parser.add_argument("--repeat", type=int, default=1, help="重播幾次")
+    parser.add_argument("--report", help="將結果以json輸出到這個檔案")
+    args = parser.parse_args()
+
+    from main import MainFrame  # 避免和 main.py 互相import
+
+    image, events = load_session(args.session)
+
+    # 重播時不要跳出對話框
+    messagebox.showinfo = messagebox.showwarning = messagebox.showerror = lambda *a, **k: None
+    messagebox.askyesno = confirm_as_recorded
+
+    root = tk.Tk()
+    frame = MainFrame(root, img_path=args.image or image, record=False)
+    frame.__img_edit__.SMOOTH_ZOOM = False  # 動畫的幀由after()觸發，重播時量不到
+    frame.pack(expand=True, fill=tk.BOTH)
+    root.geometry("=1000x600+20+20")
+    root.update()
+
+    # 調整視窗大小，使圖片顯示視窗的尺寸和記錄時一樣
+    if len(events) != 0 and "w" in events[0]:
+        dw = events[0]["w"] - frame.__img_edit__.winfo_width()
+        dh = events[0]["h"] - frame.__img_edit__.winfo_height()
+        root.geometry(f"={1000 + dw}x{600 + dh}")
+        root.update()
+
+    latency = dict()
+    for _ in range(args.repeat):
+        # 前一次重播新增／刪除的mask、多邊形的點和可視範圍都要還原，否則之後每次重播的工作量都不一樣
+        reset_session(frame)
+        for name, values in replay(frame, events).items():
+            latency.setdefault(name, []).extend(values)
+
+    report = summarize(latency)
+    for name, stat in report["events"].items():
+        print(f'{name:12s} n={stat["count"]:6d} mean={stat["mean_ms"]:8.2f}ms p50={stat["p50_ms"]:8.2f}ms p90={stat["p90_ms"]:8.2f}ms p99={stat["p99_ms"]:8.2f}ms max={stat["max_ms"]:8.2f}ms')
+
+    if args.report is not None:
+        with open(args.report, 'wt') as f:
+            json.dump(report, f, indent=4)
+
+    # 不要在關閉時存檔
+    frame.unbind("<Destroy>")
+    root.destroy()
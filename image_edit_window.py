@@ -2,11 +2,15 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 import sys
+import os.path
+import math
+import threading
 from typing import Callable
 import cv2
 import numpy as np
 import PIL.Image
 import PIL.ImageTk
+from image_header import read_image_size
 
 class ImageEditWindow(ttk.Label):
     """
@@ -23,46 +27,100 @@ class ImageEditWindow(ttk.Label):
     2. 設置 render_callback ，這樣更新畫面時可以用自定的callback來繪製其他內容
     3. 綁定按鍵事件到外部的函式上
     """
-    WHEEL_SENSITIVITY: float  = -0.05   # 滑鼠滾輪的靈敏度
+    WHEEL_SENSITIVITY: float  = -0.05   # 滑鼠滾輪的靈敏度，可視範圍縮放為 2^(delta * WHEEL_SENSITIVITY / 20) 倍，負值代表往上滾時放大
     MOUSE_SENSITIVITY: float  = 1       # 滑鼠平移的靈敏度
-    ORIGINAL_IMG: cv2.Mat               # 原始圖片
+    PREVIEW_MIN_PIXELS: int   = 4000 * 4000         # 像素數超過此值的圖片會先顯示縮小版，原圖在背景解碼
+    PREVIEW_EXTS: tuple[str]  = (".jpg", ".jpeg")   # 可以用 IMREAD_REDUCED_* 快速解碼的格式（其他格式仍會完整解碼後才縮小，沒有好處）
+    SMOOTH_ZOOM: bool         = True    # 滾輪縮放時是否以動畫過渡
+    MIN_VIEW_PIXELS: int      = 8       # 放到最大時，可視範圍的短邊至少包含幾個原圖像素
+    ORIGINAL_IMG: cv2.Mat | None        # 原始圖片，背景解碼尚未完成時為None
+    IMG_SIZE: tuple[int, int]           # 原始圖片的 (寬, 高)，即使原圖還沒解碼完成也是正確的
     WINDOW_MESSAGE: tk.StringVar        # 欲顯示的資訊（含鼠標位置、可視範圍的(x1, y1, x2, y2)）
-    __viewport__: list[int]             # 顯示範圍，[x, y, dx, dy]，分別代表 [起始x座標, 起始y座標, 水平長度, 垂直長度]，意義跟 cv2.boundingRect 的回傳值一樣
-    __ratio__: int                      # 縮放比例，1->最小，100->最大
+    __viewport__: list[float]           # 顯示範圍，[x, y, dx, dy]，分別代表 [起始x座標, 起始y座標, 水平長度, 垂直長度]，意義跟 cv2.boundingRect 的回傳值一樣，但可以是浮點數
+    __ratio__: float                    # 縮放比例，可視範圍的尺寸為原圖的 ratio%，最大為100，最小由 MIN_VIEW_PIXELS 決定
+    __target_ratio__: float             # 縮放動畫最後要到達的ratio
+    __zoom_anchor__: tuple[int, int]    # 縮放動畫中保持不動的點，相對於widget左上角的（x, y）座標
+    __zoom_animating__: bool            # 縮放動畫是否正在進行
     __drag_start__: list[int]           # 開始拖移的位置，相對於widget左上角的（x, y）座標
-    __render_callback__: Callable[[cv2.Mat, tuple[int]], None] | None # 繪製額外資訊的callback，參數有兩個：切割後的圖片、在原圖片中的bounding box (x, y, w, h)
-    __SHOWED_IMG__: PIL.ImageTk.PhotoImage
-
-
-    def __init__(self, master: tk.Misc, file_path: str, render_callback: Callable[[cv2.Mat, tuple[int]], None] | None = None):
+    __render_callback__: Callable[[cv2.Mat, tuple[float]], None] | None # 繪製額外資訊的callback，參數有兩個：縮放到widget尺寸的畫面、可視範圍 (x, y, w, h)
+    __memory_callback__: Callable[[], None] | None # 圖片佔用的記憶體變多時（原圖解碼完成、金字塔多算了一層）呼叫的callback
+    __preview_img__: cv2.Mat | None     # 原圖解碼完成前所顯示的縮小版圖片
+    __preview_scale__: int              # __preview_img__ 縮小的倍數（原圖座標 = 縮小版座標 * __preview_scale__）
+    __pending_img__: cv2.Mat | None     # 背景執行緒解碼完成的原圖，等主執行緒取用
+    __pending_pyramid__: list[cv2.Mat]  # 背景執行緒預先算好的影像金字塔
+    __pyramid__: list[cv2.Mat]          # 影像金字塔，__pyramid__[k] 為原圖縮小 2^k 倍，[0] 即 ORIGINAL_IMG，需要時才計算
+    __pending_error__: Exception | None # 背景執行緒解碼失敗的原因
+    __render_level__: int               # 上一次update所用的金字塔層，shrink_pyramid 不會丟掉這一層（含）以前的層
+    __SHOWED_IMG__: PIL.ImageTk.PhotoImage | None # 持續使用的PhotoImage，只有widget尺寸改變時才重建
+    __frame_buf__: np.ndarray | None    # 存放縮放後的圖片（H * W * 3），尺寸和widget一樣
+    __rgba_buf__: np.ndarray | None     # 和 __frame_img__ 共用記憶體的 H * W * 4 buffer
+    __frame_img__: PIL.Image.Image | None # 以 __rgba_buf__ 為底的PIL圖片，用來paste進 __SHOWED_IMG__
+
+
+    def __init__(self, master: tk.Misc, file_path: str, render_callback: Callable[[cv2.Mat, tuple[float]], None] | None = None,
+                 memory_callback: Callable[[], None] | None = None):
         """
         初始化一個畫面編輯視窗
 
         Args:
             master: 屬於哪個Widget
             file_path: 圖片的路徑
-            render_callback: 用來繪製額外資訊的callback，參數有兩個：切割後的圖片、在原圖片中的bounding box (x, y, w, h)
+            render_callback: 用來繪製額外資訊的callback，參數有兩個：已縮放到widget尺寸的畫面、可視範圍在原圖中的 (x, y, w, h)（可以是浮點數）。
+                             畫面涵蓋可視範圍，但尺寸和可視範圍不一樣，繪製時要依兩者的比例縮放。
+                             因為是畫在螢幕解析度上，線條的粗細不會隨著縮放改變
+            memory_callback: 圖片佔用的記憶體變多時呼叫，用來檢查記憶體預算（例如 MainFrame.__enforce_budget__）
         """
         ttk.Label.__init__(self, master, text="", anchor=tk.NW)
 
         # 原圖片
         # 解決「當路徑中有Unicode字元時」造成cv2.imread失敗的問題
         # https://jdhao.github.io/2019/09/11/opencv_unicode_image_path/#google_vignette
+        self.ORIGINAL_IMG = None
+        self.__preview_img__ = None
+        self.__preview_scale__ = 1
+        self.__pending_img__ = None
+        self.__pending_pyramid__ = []
+        self.__pending_error__ = None
+        self.__pyramid__ = []
         try:
-            self.ORIGINAL_IMG = cv2.imdecode(np.fromfile(file_path, dtype=np.uint8), cv2.IMREAD_COLOR)
-            assert self.ORIGINAL_IMG is not None
-            self.ORIGINAL_IMG = cv2.cvtColor(self.ORIGINAL_IMG, cv2.COLOR_BGR2RGB)
+            data = np.fromfile(file_path, dtype=np.uint8)
+            scale = self.__choose_preview_scale__(file_path)
+
+            if scale == 1:
+                self.ORIGINAL_IMG = self.__decode__(data, cv2.IMREAD_COLOR)
+                self.IMG_SIZE = (self.ORIGINAL_IMG.shape[1], self.ORIGINAL_IMG.shape[0])
+                self.__pyramid__ = [self.ORIGINAL_IMG]
+            else:
+                # 先解碼縮小版，原圖交給背景執行緒
+                flag = cv2.IMREAD_REDUCED_COLOR_8 if scale == 8 else cv2.IMREAD_REDUCED_COLOR_4
+                self.__preview_img__ = self.__decode__(data, flag)
+                self.__preview_scale__ = scale
+                threading.Thread(target=self.__decode_in_background__, args=(data,), daemon=True).start()
+                self.after(100, self.__poll_background_decode__)
         except:
             messagebox.showerror("Error", f"無法開啟圖片 \"{file_path}\"")
             sys.exit(-1)
         # 顯示資訊
-        self.WINDOW_MESSAGE = tk.StringVar(value=f'載入 {file_path} 成功')
+        if self.ORIGINAL_IMG is None:
+            self.WINDOW_MESSAGE = tk.StringVar(value=f'已顯示 {file_path} 的縮小版（1/{self.__preview_scale__}），原圖載入中......')
+        else:
+            self.WINDOW_MESSAGE = tk.StringVar(value=f'載入 {file_path} 成功')
         # 顯示的圖片範圍
-        self.__viewport__ = [0, 0, self.ORIGINAL_IMG.shape[1], self.ORIGINAL_IMG.shape[0]]
+        self.__viewport__ = [0.0, 0.0, float(self.IMG_SIZE[0]), float(self.IMG_SIZE[1])]
         # 縮放比例
-        self.__ratio__ = 100
+        self.__ratio__ = 100.0
+        self.__target_ratio__ = 100.0
+        self.__zoom_anchor__ = (0, 0)
+        self.__zoom_animating__ = False
         # render callback
         self.__render_callback__ = render_callback
+        self.__memory_callback__ = memory_callback
+        # 重複使用的buffer，第一次update時才配置
+        self.__SHOWED_IMG__ = None
+        self.__frame_buf__ = None
+        self.__rgba_buf__ = None
+        self.__frame_img__ = None
+        self.__render_level__ = 0
 
         # 綁定事件
         self.bind("<Button-3>", self.set_drag_start) # 按下滑鼠右鍵時計下位置
@@ -72,6 +130,81 @@ class ImageEditWindow(ttk.Label):
         self.bind("<Motion>", self.update_message) # 每當滑鼠移動，更新位置資訊
 
 
+    def __choose_preview_scale__(self, file_path: str) -> int:
+        """
+        從檔頭讀出圖片尺寸（存進 IMG_SIZE），並決定是否要先顯示縮小版
+
+        Return:
+            縮小的倍數，1代表直接解碼原圖（檔頭讀不到時也是，交給 OpenCV 完整解碼）
+        """
+        if os.path.splitext(file_path)[1].lower() not in self.PREVIEW_EXTS:
+            return 1
+
+        try:
+            self.IMG_SIZE = read_image_size(file_path)
+        except Exception:
+            return 1
+
+        pixels = self.IMG_SIZE[0] * self.IMG_SIZE[1]
+        if pixels >= 4 * self.PREVIEW_MIN_PIXELS:
+            return 8
+        if pixels >= self.PREVIEW_MIN_PIXELS:
+            return 4
+        return 1
+
+    @staticmethod
+    def __decode__(data: np.ndarray, flag: int) -> cv2.Mat:
+        """
+        將檔案內容解碼成RGB圖片，失敗則丟出ValueError
+        """
+        img = cv2.imdecode(data, flag)
+        if img is None:
+            raise ValueError("imdecode failed")
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    def __decode_in_background__(self, data: np.ndarray):
+        """
+        在背景執行緒解碼原圖。tkinter不是thread-safe，所以這裡只存結果，由 __poll_background_decode__ 在主執行緒套用
+        """
+        try:
+            img = self.__decode__(data, cv2.IMREAD_COLOR)
+            # 大圖的金字塔也在背景算好，之後才不會卡住主執行緒
+            pyramid = [img]
+            while max(pyramid[-1].shape[:2]) > 2048:
+                pyramid.append(cv2.pyrDown(pyramid[-1]))
+            self.__pending_pyramid__ = pyramid
+            self.__pending_img__ = img
+        except Exception as e:
+            self.__pending_error__ = e
+
+    def __poll_background_decode__(self):
+        """
+        檢查背景解碼是否完成，完成則換成原圖並重繪，否則稍後再檢查
+        """
+        if self.__pending_error__ is not None:
+            self.WINDOW_MESSAGE.set(f'原圖解碼失敗（{repr(self.__pending_error__)}），繼續使用縮小版')
+            self.__pending_error__ = None
+            return
+
+        if self.__pending_img__ is None:
+            self.after(100, self.__poll_background_decode__)
+            return
+
+        self.ORIGINAL_IMG = self.__pending_img__
+        self.IMG_SIZE = (self.ORIGINAL_IMG.shape[1], self.ORIGINAL_IMG.shape[0])
+        self.__pyramid__ = self.__pending_pyramid__
+        self.__pending_img__ = None
+        self.__pending_pyramid__ = []
+        self.__preview_img__ = None
+        self.__preview_scale__ = 1
+        self.WINDOW_MESSAGE.set('原圖載入完成')
+        self.__adjust_viewport__()
+        self.update(None)
+        # 原圖和整個金字塔換進來之後才檢查預算，這時 __render_level__ 已經是原圖的層，不會被丟掉
+        if self.__memory_callback__ is not None:
+            self.__memory_callback__()
+
+
     def set_drag_start(self, event : tk.Event):
         """
         將 `event.x` 和 `event.y` 記錄在 `self.__drag_start__`
@@ -84,14 +217,16 @@ class ImageEditWindow(ttk.Label):
 
     def pan(self, event : tk.Event):
         """
-        平移viewport
+        平移viewport，使得畫面跟著滑鼠移動
 
         Args:
             event: tkinter的Event物件，用來知道滑鼠的位置
         """
-        # 依據滑鼠移動的距離計算dx, dy
-        dx = int((self.__drag_start__[0] - event.x) * self.MOUSE_SENSITIVITY)
-        dy = int((self.__drag_start__[1] - event.y) * self.MOUSE_SENSITIVITY)
+        # 依據滑鼠移動的距離計算dx, dy，螢幕上的距離要換算成原圖的距離
+        _, _, view_dx, view_dy = self.__viewport__
+        W, H = max(self.winfo_width(), 1), max(self.winfo_height(), 1)
+        dx = (self.__drag_start__[0] - event.x) * self.MOUSE_SENSITIVITY * view_dx / W
+        dy = (self.__drag_start__[1] - event.y) * self.MOUSE_SENSITIVITY * view_dy / H
 
         # 移動viewport
         self.__viewport__[0] += dx
@@ -105,38 +240,66 @@ class ImageEditWindow(ttk.Label):
 
     def zoom(self, event : tk.Event):
         """
-        當滾動滑鼠時zoom in/ zoom out
+        當滾動滑鼠時zoom in/ zoom out。縮放是連續的（以倍數計算），若 SMOOTH_ZOOM 為True則以動畫過渡
 
         Args:
             event: tkinter的Event物件，用來知道滑鼠的位置
         """
-        pixelX, pixelY = self.to_original_pixel(event.x, event.y)
-        old_x, old_y, old_dx, old_dy = self.__viewport__
+        # 依滾動量，更新目標ratio（連續滾動時會累加）
+        factor = 2 ** (event.delta * self.WHEEL_SENSITIVITY / 20)
+        self.__target_ratio__ = self.__clip_ratio__(self.__target_ratio__ * factor)
+        self.__zoom_anchor__ = (event.x, event.y)
+        self.update_message(event)
+
+        if not self.SMOOTH_ZOOM:
+            self.__set_ratio__(self.__target_ratio__, self.__zoom_anchor__)
+            self.update(event)
+        elif not self.__zoom_animating__:
+            self.__zoom_animating__ = True
+            self.__animate_zoom__()
+
+    def __animate_zoom__(self):
+        """
+        每一幀將ratio往目標移動一半（以對數計算），中間的幀用較粗的金字塔層繪製，到達目標後再以完整畫質繪製
+        """
+        ratio, target = self.__ratio__, self.__target_ratio__
+        done = abs(math.log(target / ratio)) < 0.01
+        self.__set_ratio__(target if done else math.sqrt(ratio * target), self.__zoom_anchor__)
+
+        if done:
+            self.__zoom_animating__ = False
+            self.update(None)
+        else:
+            self.update(None, fast=True)
+            self.after(16, self.__animate_zoom__)
 
-        # 依滾動量，更新ratio
-        delta = int(event.delta * self.WHEEL_SENSITIVITY)
-        self.__ratio__ = np.clip(self.__ratio__ + delta, 1, 100)
+    def __set_ratio__(self, ratio: float, anchor: tuple[int, int]):
+        """
+        將縮放比例設為ratio，並移動viewport，使得widget中的anchor點在縮放前後對應到原圖的同一點
+        """
+        W, H = max(self.winfo_width(), 1), max(self.winfo_height(), 1)
+        old_x, old_y, old_dx, old_dy = self.__viewport__
+        self.__ratio__ = ratio
 
         # 改變viewport的尺寸
-        new_dx = self.ORIGINAL_IMG.shape[1] * self.__ratio__ // 100  # 尺寸是以原圖的 ratio% 計算
-        new_dy = self.ORIGINAL_IMG.shape[0] * self.__ratio__ // 100
-        self.__viewport__[2:] = [new_dx, new_dy]
+        new_dx = self.IMG_SIZE[0] * ratio / 100  # 尺寸是以原圖的 ratio% 計算
+        new_dy = self.IMG_SIZE[1] * ratio / 100
 
-        # 移動viewport，使得(pixelX, pixelY)在移動後的viewport中仍有一樣的相對位置
-        #
-        # (pixelX - x) / dx = (pixelX - x') / dx'
-        # 移項得 x' = pixelX - (pixelX - x) * dx' / dx
-        #
-        self.__viewport__[0] = pixelX - (pixelX - old_x) * new_dx // old_dx
+        # 移動viewport，使得anchor在移動後的viewport中仍有一樣的相對位置
         #
-        # (pixelY - y) / dy = (pixelY - y') / dy'
-        # 移項得 y' = pixelY - (pixelY - y) * dy' / dy
+        # pixelX = x + ax * dx / W = x' + ax * dx' / W
+        # 移項得 x' = x + ax * (dx - dx') / W
         #
-        self.__viewport__[1] = pixelY - (pixelY - old_y) * new_dy // old_dy
-
-        # update
+        ax, ay = anchor
+        self.__viewport__ = [old_x + ax * (old_dx - new_dx) / W, old_y + ay * (old_dy - new_dy) / H, new_dx, new_dy]
         self.__adjust_viewport__()
-        self.update(event)
+
+    def __clip_ratio__(self, ratio: float) -> float:
+        """
+        將ratio限制在 [可視範圍短邊剛好為 MIN_VIEW_PIXELS 個像素, 100]
+        """
+        min_ratio = 100.0 * self.MIN_VIEW_PIXELS / min(self.IMG_SIZE)
+        return float(np.clip(ratio, min(min_ratio, 100.0), 100.0))
 
     def change_viewport(self, view: tuple[int]):
         """
@@ -146,62 +309,154 @@ class ImageEditWindow(ttk.Label):
             view: (x, y, w, h)
         """
         viewX, viewY, viewW, viewH = view
-        IMG_H, IMG_W, _ = self.ORIGINAL_IMG.shape
+        IMG_W, IMG_H = self.IMG_SIZE
 
         # 改變ratio
         # 看 viewW 和 viewH 相對於 IMG_W 和 IMG_H 的比例，哪個大選哪個
         ratioW = viewW * 100.0 / IMG_W
         ratioH = viewH * 100.0 / IMG_H
-        ratio = np.clip(np.max((ratioW, ratioH)), 1, 100) # 使用浮點數
-        self.__ratio__ = int(ratio)
+        ratio = self.__clip_ratio__(max(ratioW, ratioH))
+        self.__ratio__ = self.__target_ratio__ = ratio
 
         # 調整viewport大小
-        # 為了讓可視範圍盡量接近view，所以先用浮點數計算，最後再轉int
-        viewportW = int(np.ceil(IMG_W * ratio / 100.0))
-        viewportH = int(np.ceil(IMG_H * ratio / 100.0))
+        viewportW = IMG_W * ratio / 100.0
+        viewportH = IMG_H * ratio / 100.0
         self.__viewport__[2:4] = [viewportW, viewportH]
 
         # 移動viewport
         # 若寬的比例比較大 -> 可視範圍的寬度會和view的寬差不多。此時，我希望view可以盡量垂直置中。
         if ratioW > ratioH:
-            self.__viewport__[0:2] = [viewX, viewY - (viewportH - viewH) // 2]
+            self.__viewport__[0:2] = [viewX, viewY - (viewportH - viewH) / 2]
         # 反之，可視範圍的高會和view差不多。此時，我希望view可以盡量水平置中。
         else:
-            self.__viewport__[0:2] = [viewX - (viewportW - viewW) // 2, viewY]
+            self.__viewport__[0:2] = [viewX - (viewportW - viewW) / 2, viewY]
 
         # 更新畫面
         self.__adjust_viewport__()
         self.update(None)
 
 
-    def update(self, event : tk.Event | None):
+    def update(self, event : tk.Event | None, fast: bool = False):
         """
         更新顯示的圖片
 
+        從影像金字塔中選擇解析度剛好不低於螢幕的一層來切割，放大超過1:1時以nearest neighbor顯示，讓每個像素清楚可見
+
         Args:
             event: 若不為None，則順便更新 WINDOW_MESSAGE
+            fast: 若為True則改用更粗一層的金字塔（動畫的中間幀使用）
         """
         if event is not None:
             self.update_message(event)
 
-        # 切割圖片
+        W, H = self.__ensure_frame_buffer__()
         x, y, dx, dy = self.__viewport__
-        img = self.ORIGINAL_IMG[y : y+dy, x : x+dx].copy()
 
-        # 呼叫 render callback
+        # 選擇金字塔的層：每個像素仍對應到至少一個螢幕像素
+        k = max(int(math.floor(math.log2(max(min(dx / W, dy / H), 1.0)))), 0)
+        if fast:
+            k += 1
+        levels = len(self.__pyramid__)
+        src, f = self.pyramid_level(k)
+        self.__render_level__ = k
+
+        # 切割出包住可視範圍的整數區域（只是view，不會複製）
+        sx1, sy1 = max(int(x // f), 0), max(int(y // f), 0)
+        sx2, sy2 = min(int(math.ceil((x + dx) / f)), src.shape[1]), min(int(math.ceil((y + dy) / f)), src.shape[0])
+        img = src[sy1:sy2, sx1:sx2]
+
+        # 將 img 對應到 widget，直接寫進和PhotoImage共用的buffer
+        # warpAffine 以像素中心為整數座標：img 的像素 c 的中心在原圖的 (c + sx1 + 0.5) * f，
+        # 對應到 widget 的 ((c + sx1 + 0.5) * f - x) * W / dx - 0.5，和 to_original_pixel 的換算一致
+        zx, zy = f * W / dx, f * H / dy
+        M = np.array([
+            [zx, 0, (sx1 * f - x) * W / dx + 0.5 * zx - 0.5],
+            [0, zy, (sy1 * f - y) * H / dy + 0.5 * zy - 0.5]
+        ], np.float32)
+        interpolation = cv2.INTER_NEAREST if zx > 1 else cv2.INTER_LINEAR
+        cv2.warpAffine(img, M, (W, H), dst=self.__frame_buf__, flags=interpolation, borderMode=cv2.BORDER_REPLICATE)
+
+        # 在縮放後的畫面上呼叫 render callback，這樣多邊形和方框在任何縮放比例下都是固定的螢幕像素寬
         if self.__render_callback__ is not None:
-            self.__render_callback__(img, self.__viewport__)
+            self.__render_callback__(self.__frame_buf__, (x, y, dx, dy))
+
+        cv2.cvtColor(self.__frame_buf__, cv2.COLOR_RGB2RGBA, dst=self.__rgba_buf__)
+
+        # 更新既有的PhotoImage，不重新建立
+        self.__SHOWED_IMG__.paste(self.__frame_img__)
 
-        # 調整圖片大小
-        img = cv2.resize(img, (self.winfo_width(), self.winfo_height()))
-        img = PIL.Image.fromarray(img)
-        img = PIL.ImageTk.PhotoImage(img)
+        # 金字塔多算了層，檢查記憶體預算（畫完才檢查，__render_level__ 以前的層不會被丟掉）
+        if len(self.__pyramid__) > levels and self.__memory_callback__ is not None:
+            self.__memory_callback__()
 
-        # 設置圖片
-        self["image"] = img
-        self.__SHOWED_IMG__ = img # 增加reference，以免img被回收
+    def __ensure_frame_buffer__(self) -> tuple[int, int]:
+        """
+        確保 __frame_buf__、__rgba_buf__、__frame_img__ 和 __SHOWED_IMG__ 的尺寸和widget一樣，只有尺寸改變時才重新配置
+
+        Return:
+            (W, H): widget的寬和高
+        """
+        W, H = max(self.winfo_width(), 1), max(self.winfo_height(), 1)
+
+        if self.__frame_buf__ is None or self.__frame_buf__.shape[:2] != (H, W):
+            self.__frame_buf__ = np.empty((H, W, 3), np.uint8)
+            self.__rgba_buf__ = np.empty((H, W, 4), np.uint8)
+            # RGBA 的 frombuffer 會和 numpy 陣列共用記憶體，不會複製
+            self.__frame_img__ = PIL.Image.frombuffer("RGBA", (W, H), self.__rgba_buf__, "raw", "RGBA", 0, 1)
+            self.__SHOWED_IMG__ = PIL.ImageTk.PhotoImage("RGBA", (W, H))
+            self["image"] = self.__SHOWED_IMG__ # 這裡也保留了reference，以免被回收
+
+        return W, H
 
     
+    def get_viewport(self) -> tuple[int, int, int, int]:
+        """
+        包住目前可視範圍的整數區域 (x, y, dx, dy)，原圖座標
+        """
+        x, y, dx, dy = self.__viewport__
+        x1, y1 = int(math.floor(x)), int(math.floor(y))
+        return (x1, y1, int(math.ceil(x + dx)) - x1, int(math.ceil(y + dy)) - y1)
+
+    def pyramid_level(self, k: int) -> tuple[cv2.Mat, int]:
+        """
+        取得影像金字塔的第k層（原圖縮小 2^k 倍），沒算過的層會在這時候算
+
+        原圖還沒解碼完成時，一律回傳縮小版
+
+        Return:
+            (圖片, 實際縮小的倍數)
+        """
+        if self.ORIGINAL_IMG is None:
+            return self.__preview_img__, self.__preview_scale__
+
+        while len(self.__pyramid__) <= k:
+            self.__pyramid__.append(cv2.pyrDown(self.__pyramid__[-1]))
+        return self.__pyramid__[k], 2 ** k
+
+    def memory_usage(self) -> dict[str, int]:
+        """
+        各部份圖片資料佔用的位元組數
+        """
+        W, H = (self.__frame_buf__.shape[1], self.__frame_buf__.shape[0]) if self.__frame_buf__ is not None else (0, 0)
+        buffers = [self.__frame_buf__, self.__rgba_buf__]
+        return {
+            "image": self.ORIGINAL_IMG.nbytes if self.ORIGINAL_IMG is not None else 0,
+            "preview": self.__preview_img__.nbytes if self.__preview_img__ is not None else 0,
+            "pyramid": sum(level.nbytes for level in self.__pyramid__[1:]),
+            "render_buffers": sum(b.nbytes for b in buffers if b is not None),
+            "photo_image": W * H * 4, # Tk的photo image每個像素4 bytes
+        }
+
+    def shrink_pyramid(self, nbytes: int):
+        """
+        從最小的層開始往回丟掉金字塔，直到佔用不超過nbytes。被丟掉的層之後需要時會重算
+
+        畫面正在使用的層（__render_level__）以及比它大的層不會被丟掉，否則下一次update就得在主執行緒上從原圖重算整串 pyrDown
+        """
+        keep = self.__render_level__ + 1
+        while len(self.__pyramid__) > max(keep, 1) and sum(level.nbytes for level in self.__pyramid__[1:]) > nbytes:
+            self.__pyramid__.pop()
+
     def update_message(self, event : tk.Event):
         """
         移據滑鼠現在的位置更新顯示的資訊
@@ -210,7 +465,7 @@ class ImageEditWindow(ttk.Label):
             event: 用來取得滑鼠的位置
         """
         pixelX, pixelY = self.to_original_pixel(event.x, event.y)
-        x, y, w, h = self.__viewport__
+        x, y, w, h = self.get_viewport()
         self.WINDOW_MESSAGE.set(f"x: {pixelX}, y: {pixelY}\t\t\t可視範圍: (x1, y1, x2, y2) = {(x, y, x+w, y+h)}")
 
     
@@ -223,12 +478,13 @@ class ImageEditWindow(ttk.Label):
             y: 離widget的上邊界幾個像素。範圍：[0, self.winfo_height())
 
         Return:
-            (pixelX, pixelY): (x, y)對應到原圖中的 `self.ORIGINAL_IMG[pixelY][pixelX]`
+            (pixelX, pixelY): (x, y)對應到原圖中的 `self.ORIGINAL_IMG[pixelY][pixelX]`（顯示縮小版時也是原圖的座標）
         """
         viewX, viewY, dx, dy = self.__viewport__
 
-        pixelX = int(np.interp(x, [0, self.winfo_width()], [viewX, viewX + dx]))
-        pixelY = int(np.interp(y, [0, self.winfo_height()], [viewY, viewY + dy]))
+        # 以螢幕像素的中心換算，和 update 中 warpAffine 的對應方式相同
+        pixelX = int(np.interp(x + 0.5, [0, self.winfo_width()], [viewX, viewX + dx]))
+        pixelY = int(np.interp(y + 0.5, [0, self.winfo_height()], [viewY, viewY + dy]))
         
         return (pixelX, pixelY)
     
@@ -239,8 +495,8 @@ class ImageEditWindow(ttk.Label):
         """
         x, y, dx, dy = self.__viewport__
 
-        x = np.clip(x, 0, self.ORIGINAL_IMG.shape[1] - dx)
-        y = np.clip(y, 0, self.ORIGINAL_IMG.shape[0] - dy)
+        x = float(np.clip(x, 0, self.IMG_SIZE[0] - dx))
+        y = float(np.clip(y, 0, self.IMG_SIZE[1] - dy))
 
         self.__viewport__[0:2] = [x, y]
 
@@ -0,0 +1,24 @@
+import PIL.Image
+
+EXIF_ORIENTATION = 0x0112
+
+def read_image_size(IMG_PATH: str) -> tuple[int, int]:
+    """
+    只讀檔頭取得圖片尺寸，結果和 OpenCV 解碼後的尺寸一致
+
+    OpenCV 解碼時會依 EXIF 旋轉圖片，orientation 為 5~8 時長寬會對調
+
+    Return:
+        (w, h)，讀不到檔頭時丟出例外
+    """
+    # PIL.Image.open 只讀檔頭，不會解碼，所以暫時關掉 decompression bomb 的檢查（否則約179MP以上的圖會丟出例外）
+    max_pixels = PIL.Image.MAX_IMAGE_PIXELS
+    PIL.Image.MAX_IMAGE_PIXELS = None
+    try:
+        with PIL.Image.open(IMG_PATH) as header:
+            w, h = header.size
+            if header.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+                w, h = h, w
+    finally:
+        PIL.Image.MAX_IMAGE_PIXELS = max_pixels
+    return w, h
@@ -2,10 +2,15 @@ from image_edit_window import ImageEditWindow
 from control_frame import ControlFrame
 from polygon import Polygon
 from mask_database import MaskDatabase
+from event_recorder import EventRecorder
+from memory_budget import MemoryBudget
+from edit_history import EditHistory, AddPointCommand, PopPointCommand, ClearPointsCommand, ReplacePointsCommand, AddMaskCommand, DeleteMaskCommand, SetLabelCommand
+import region_grow
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
+from typing import Callable
 import json
 import sys
 import os.path
@@ -21,21 +26,36 @@ class MainFrame(ttk.Frame):
     主要功能： 當作__img_edit__和__control__間溝通的橋梁，如果有功能會同時用到這兩個widget，則會在MainFrame實作
     """
     IMG_REL_PATH: str             # 圖片的相對路徑（相對於工作目錄）
-    DEBUG_MODE: bool              # 是否為除錯模式
+    GROW_TOLERANCE: float = 20    # 自動選取區域時，顏色容許的差異
+    GROW_MAX_SIDE: int = 1024     # 自動選取區域時，處理的影像最長邊不超過此值（會選擇適當的金字塔層）
+    DEBUG_MODE: bool = False      # 是否為除錯模式
     __img_edit__: ImageEditWindow # 圖片顯示視窗
     __control__: ControlFrame     # 控制面版
     __polygon__: Polygon          # 多邊形
     __mask_db__: MaskDatabase     # 儲存所有的Mask
+    __history__: EditHistory      # undo / redo
+    __budget__: MemoryBudget      # 記憶體用量的統計及預算
+    HANDLERS: dict[str, Callable] # 事件名稱 -> 綁定的handler（錄製時為包裝過的版本）
+    __record_path__: str | None = None      # setting.json 中的 record_events
+    __recorder__: EventRecorder | None = None # 錄製事件用，不錄製時為None
 
-    def __init__(self, master: tk.Misc):
+    def __init__(self, master: tk.Misc, img_path: str | None = None, record: bool = True):
         """
         初始化
+
+        Args:
+            master: parent widget
+            img_path: 要標記的圖片，None代表用file dialog選擇
+            record: 若為False，即使setting.json有設定record_events也不錄製（重播時使用）
         """
         ttk.Frame.__init__(self, master, padding=10)
         self.rowconfigure(0, weight=1)
         self.columnconfigure(0, weight=1)
 
-        IMG_ABS_PATH = filedialog.askopenfilename(filetypes=[("img", ["*.jpg", "*.png", "*.tif"])], initialdir=WORKSPACE_DIR)
+        if img_path is None:
+            IMG_ABS_PATH = filedialog.askopenfilename(filetypes=[("img", ["*.jpg", "*.png", "*.tif"])], initialdir=WORKSPACE_DIR)
+        else:
+            IMG_ABS_PATH = os.path.abspath(img_path)
         if IMG_ABS_PATH == "":
             sys.exit(0)
         self.IMG_REL_PATH = os.path.relpath(IMG_ABS_PATH, '.')
@@ -45,6 +65,7 @@ class MainFrame(ttk.Frame):
             self
             , file_path= IMG_ABS_PATH
             , render_callback= self.__render_polygon_and_box__
+            , memory_callback= self.__enforce_budget__
         )
         self.__img_edit__.grid(row=0, column=0, sticky=(tk.N, tk.S, tk.E, tk.W))
         # 狀態欄
@@ -58,23 +79,82 @@ class MainFrame(ttk.Frame):
         self.__polygon__ = Polygon()
         # database
         self.__mask_db__ = MaskDatabase()
+        # undo / redo
+        self.__history__ = EditHistory()
         self.reload_mask()
 
+        # 記憶體統計，可淘汰的部份依「快取 -> 金字塔（只丟畫面沒用到的層） -> 復原記錄」的順序釋放
+        self.__budget__ = MemoryBudget()
+        for name in ("image", "preview", "render_buffers", "photo_image"):
+            self.__budget__.add_source(name, lambda name=name: self.__img_edit__.memory_usage()[name])
+        self.__budget__.add_source("mask_lists", self.__mask_db__.list_nbytes)
+        self.__budget__.add_source("mask_cache", self.__mask_db__.CACHE.nbytes, self.__mask_db__.CACHE.shrink_to)
+        self.__budget__.add_source("pyramid", lambda: self.__img_edit__.memory_usage()["pyramid"], self.__img_edit__.shrink_pyramid)
+        self.__budget__.add_source("history", self.__history__.nbytes, self.__history__.shrink_to)
+
         # 載入設定檔
         self.__read_setting__()
 
+        # 錄製事件
+        self.HANDLERS = self.event_handlers()
+        if record and self.__record_path__:
+            self.__recorder__ = EventRecorder(self.__record_path__, self.IMG_REL_PATH)
+            self.HANDLERS = {
+                name: self.__recorder__.wrap(name, handler, self.__event_state__) for name, handler in self.HANDLERS.items()
+            }
+            # 覆蓋 ImageEditWindow 內部的綁定，這樣平移和縮放也會被錄到
+            self.__img_edit__.bind("<Button-3>", self.HANDLERS["drag_start"])
+            self.__img_edit__.bind("<B3-Motion>", self.HANDLERS["pan"])
+            self.__img_edit__.bind("<MouseWheel>", self.HANDLERS["zoom"])
+
         # 事件綁定
-        self.__img_edit__.bind("<Button-1>", self.__add_polygon_point__) # 按下左鍵，則新增一點
+        self.__img_edit__.bind("<Button-1>", self.HANDLERS["add_point"]) # 按下左鍵，則新增一點
+        self.__img_edit__.bind("<Shift-Button-1>", self.HANDLERS["grow_region"]) # Shift + 左鍵，自動選取區域
         self.__control__.bind("<<Repaint>>", self.__img_edit__.update)   # 收到repaint後更新畫面
-        self.__control__.DELETE_BTN.configure(command=self.__delete_last_polygon_point__)
-        self.__control__.CLEAR_BTN.configure(command=self.__clear_polygon_point__)
-        self.__control__.ADD_MASK_BTN.configure(command=self.__add_mask__)     # 按下按鈕->加入mask
-        self.__control__.DEL_MASK_BTN.configure(command=self.__delete_mask__)  # 按下按鈕->移除mask
-        self.__control__.MASK_LIST.bind("<<ListboxSelect>>", self.__highlight_mask__) # https://stackoverflow.com/a/6557251/20876404
-        self.__control__.MASK_LIST.bind("<Double-Button-1>", self.__focus_on_mask__)
-        self.__control__.MASK_LIST.bind("f", self.__focus_on_mask__)
-        self.__control__.MASK_LIST.bind("<KeyPress-Delete>", self.__delete_mask__)
+        self.__control__.DELETE_BTN.configure(command=self.HANDLERS["pop_point"])
+        self.__control__.CLEAR_BTN.configure(command=self.HANDLERS["clear_points"])
+        self.__control__.ADD_MASK_BTN.configure(command=self.HANDLERS["add_mask"])     # 按下按鈕->加入mask
+        self.__control__.DEL_MASK_BTN.configure(command=self.HANDLERS["delete_mask"])  # 按下按鈕->移除mask
+        self.__control__.MASK_LIST.bind("<<ListboxSelect>>", self.HANDLERS["highlight"]) # https://stackoverflow.com/a/6557251/20876404
+        self.__control__.MASK_LIST.bind("<Double-Button-1>", self.HANDLERS["focus"])
+        self.__control__.MASK_LIST.bind("f", self.HANDLERS["focus"])
+        self.__control__.MASK_LIST.bind("<KeyPress-Delete>", self.HANDLERS["delete_mask"])
+        self.__control__.MASK_LIST.bind("l", self.HANDLERS["set_label"])
         self.bind("<Destroy>", self.save_mask)
+        self.bind("<Destroy>", self.__close_recorder__, add="+")
+
+    def event_handlers(self) -> dict[str, Callable]:
+        """
+        所有可以被錄製和重播的事件，名稱 -> handler
+        """
+        return {
+            "drag_start": self.__img_edit__.set_drag_start,
+            "pan": self.__img_edit__.pan,
+            "zoom": self.__img_edit__.zoom,
+            "add_point": self.__add_polygon_point__,
+            "pop_point": self.__delete_last_polygon_point__,
+            "clear_points": self.__clear_polygon_point__,
+            "grow_region": self.__grow_region__,
+            "add_mask": self.__add_mask__,
+            "delete_mask": self.__delete_mask__,
+            "highlight": self.__highlight_mask__,
+            "focus": self.__focus_on_mask__,
+            "set_label": self.__change_mask_label__,
+            "undo": self.undo,
+            "redo": self.redo,
+        }
+
+    def __event_state__(self) -> dict:
+        """
+        錄製事件時，重播所需要的狀態
+        """
+        return {
+            "sel": list(self.__control__.MASK_LIST.curselection()),
+            "label": self.__control__.LABEL_COMBO.get(),
+            "masks": len(self.__mask_db__.__database__),
+            "w": self.__img_edit__.winfo_width(),
+            "h": self.__img_edit__.winfo_height(),
+        }
 
     # Polygon ###########################################################################################################
 
@@ -88,6 +168,7 @@ class MainFrame(ttk.Frame):
         # 將滑鼠指到的像素點加入polygon
         pixelX, pixelY = self.__img_edit__.to_original_pixel(event.x, event.y)
         self.__polygon__.addPoint(pixelX, pixelY)
+        self.__history__.push(AddPointCommand(pixelX, pixelY))
 
         # 更新畫面
         self.__img_edit__.update(None)
@@ -96,14 +177,55 @@ class MainFrame(ttk.Frame):
         """
         刪掉最後一點
         """
+        points = self.__polygon__.points()
+        if len(points) == 0:
+            return
+
+        x, y = points[-1].tolist()
         self.__polygon__.popPoint()
+        self.__history__.push(PopPointCommand(x, y))
         self.__img_edit__.update(None)
 
     def __clear_polygon_point__(self):
         """
         清除polygon中所有點
         """
+        points = self.__polygon__.points().copy()
+        if len(points) == 0:
+            return
+
         self.__polygon__.clear()
+        self.__history__.push(ClearPointsCommand(points))
+        self.__img_edit__.update(None)
+
+    def __grow_region__(self, event: tk.Event):
+        """
+        從滑鼠點到的位置開始，在可視範圍內以flood fill自動選取顏色相近的區域，並將其輪廓設為polygon
+        之後和手動繪製的polygon一樣，按「加入Mask」即可加入
+
+        Args:
+            event: 用來取得滑鼠的x, y
+        """
+        seed = self.__img_edit__.to_original_pixel(event.x, event.y)
+        x, y, dx, dy = self.__img_edit__.get_viewport()
+
+        # 選擇能讓可視範圍的最長邊不超過 GROW_MAX_SIDE 的金字塔層
+        k = 0
+        while max(dx, dy) >> k > self.GROW_MAX_SIDE:
+            k += 1
+        img, scale = self.__img_edit__.pyramid_level(k)
+
+        pts = region_grow.propose_polygon(img, scale, (x, y, x + dx, y + dy), seed, self.GROW_TOLERANCE)
+        if pts is None:
+            return
+
+        old_points = self.__polygon__.points().copy()
+        self.__polygon__.clear()
+        for px, py in pts.tolist():
+            self.__polygon__.addPoint(px, py)
+        self.__history__.push(ReplacePointsCommand(old_points, pts))
+        self.__enforce_budget__()
+
         self.__img_edit__.update(None)
 
     # Mask ###############################################################################################################
@@ -128,11 +250,15 @@ class MainFrame(ttk.Frame):
         self.__control__.MASK_LIST.selection_clear(0, tk.END)
         self.__control__.MASK_LIST.selection_set(tk.END)
         # 加進database
-        self.__mask_db__.append(bbox, label, img.tolist())
+        self.__mask_db__.append(bbox, label, img.tolist(), img)
+        idx = len(self.__mask_db__.__database__) - 1
+        self.__history__.push(AddMaskCommand(idx, self.__mask_db__.query(idx)))
 
-        # 如果有要繪製mask的bounding box，則要重新更新畫面
+        # 如果有要繪製mask的bounding box，則要重新更新畫面（會順便檢查記憶體預算）
         if self.__control__.SHOULD_DRAW_MASK_BOX.get() == '1':
             self.__highlight_mask__(None)
+        else:
+            self.__enforce_budget__()
 
     def __delete_mask__(self, event: tk.Event = None):
         """
@@ -153,15 +279,64 @@ class MainFrame(ttk.Frame):
             # 清除選擇 + 取消標記
             self.__control__.MASK_LIST.selection_clear(0, tk.END)
 
-            # 從list刪掉
-            self.__control__.MASK_LIST.delete(idx)
-            # 從db刪掉
-            self.__mask_db__.delete(idx)
+            # 從list和db刪掉，mask本身交給history保管
+            mask_data = self.__remove_mask__(idx)
+            self.__history__.push(DeleteMaskCommand(idx, mask_data))
 
-        # 如果有要繪製mask的bounding box，則要重新更新畫面
+        # 如果有要繪製mask的bounding box，則要重新更新畫面（會順便檢查記憶體預算）
         if self.__control__.SHOULD_DRAW_MASK_BOX.get() == '1':
             self.__highlight_mask__(None)
+        else:
+            self.__enforce_budget__()
         
+    def __change_mask_label__(self, event: tk.Event = None):
+        """
+        將MASK_LIST中選到的mask的標籤改成LABEL_COMBO目前的標籤
+
+        Args:
+            event: 沒用到
+        """
+        indices = self.__control__.MASK_LIST.curselection()
+        if len(indices) == 0:
+            return
+
+        idx = indices[0]
+        label = self.__control__.LABEL_COMBO.get()
+        old_label = self.__mask_db__.query(idx)["label"]
+        if label == old_label:
+            return
+
+        self.__set_mask_label__(idx, label)
+        self.__history__.push(SetLabelCommand(idx, old_label, label))
+
+    def __insert_mask__(self, idx: int, mask_data: dict):
+        """
+        將mask_data放回__mask_db__和MASK_LIST的第idx個位置（給undo / redo使用）
+        """
+        self.__mask_db__.insert(idx, mask_data)
+        self.__control__.MASK_LIST.insert(idx, mask_data["label"])
+
+    def __remove_mask__(self, idx: int) -> dict:
+        """
+        將第idx個mask從__mask_db__和MASK_LIST移除
+
+        Return:
+            被移除的mask_data
+        """
+        self.__control__.MASK_LIST.delete(idx)
+        return self.__mask_db__.delete(idx)
+
+    def __set_mask_label__(self, idx: int, label: str):
+        """
+        更改第idx個mask在__mask_db__和MASK_LIST中的標籤，並維持原本的選擇狀態
+        """
+        selected = self.__control__.MASK_LIST.selection_includes(idx)
+        self.__mask_db__.set_label(idx, label)
+        self.__control__.MASK_LIST.delete(idx)
+        self.__control__.MASK_LIST.insert(idx, label)
+        if selected:
+            self.__control__.MASK_LIST.selection_set(idx)
+
     def __focus_on_mask__(self, event: tk.Event):
         """ 
         將可視範圍聚焦在選定的mask上
@@ -183,7 +358,7 @@ class MainFrame(ttk.Frame):
         if self.DEBUG_MODE:
             if cv2.getWindowProperty("mask", cv2.WND_PROP_VISIBLE):
                 cv2.destroyWindow("mask")
-            cv2.imshow("mask", np.array(mask_data['Mask'], dtype=np.uint8))
+            cv2.imshow("mask", self.__mask_db__.get_mask(indicies[0]))
 
     def __highlight_mask__(self, event: tk.Event):
         """
@@ -195,9 +370,52 @@ class MainFrame(ttk.Frame):
         else:
             print("clear hilight")
             self.__mask_db__.set_highlight(-1)
-        
+
+        if self.DEBUG_MODE:
+            print("mask cache:", self.__mask_db__.CACHE.stats())
+
+        self.__enforce_budget__()
         self.__img_edit__.update(None)
 
+    # Undo / Redo ########################################################################################################
+
+    def undo(self, event: tk.Event = None):
+        """
+        復原最近一次的編輯（多邊形的點、新增／刪除mask、更改標籤）
+        """
+        if self.__history__.undo(self):
+            self.__highlight_mask__(None)
+
+    def redo(self, event: tk.Event = None):
+        """
+        重做最近一次被復原的編輯
+        """
+        if self.__history__.redo(self):
+            self.__highlight_mask__(None)
+
+    # Memory #############################################################################################################
+
+    def __enforce_budget__(self):
+        """
+        若記憶體用量超過 MEMORY_BUDGET_BYTES，淘汰快取等可以重建的資料
+        """
+        if self.__budget__.enforce() and self.DEBUG_MODE:
+            print("memory budget enforced:", self.__budget__.report())
+
+    def export_memory_report(self, event: tk.Event = None):
+        """
+        印出各部份佔用的記憶體，並輸出到 `{WORKSPACE_DIR}/memory_report.json`
+        """
+        report = self.__budget__.report()
+        report["mask_cache"] = self.__mask_db__.CACHE.stats()
+
+        for name, nbytes in report["sources"].items():
+            print(f'{name:16s} {nbytes / 1024 / 1024:10.2f} MB')
+        print(f'{"total":16s} {report["total"] / 1024 / 1024:10.2f} MB')
+
+        with open(f"{WORKSPACE_DIR}/memory_report.json", "wt") as f:
+            json.dump(report, f, indent=4)
+
     # Misc ###############################################################################################################
 
     def __read_setting__(self):
@@ -210,25 +428,38 @@ class MainFrame(ttk.Frame):
                 self.__img_edit__.WHEEL_SENSITIVITY = content["WHEEL_SENSITIVITY"]
             if "MOUSE_SENSITIVITY" in content.keys():
                 self.__img_edit__.MOUSE_SENSITIVITY = content["MOUSE_SENSITIVITY"]
+            if "SMOOTH_ZOOM" in content.keys():
+                self.__img_edit__.SMOOTH_ZOOM = content["SMOOTH_ZOOM"]
             if "label" in content.keys():
                 self.__control__.LABEL_COMBO.configure(values=content['label'])
                 self.__control__.LABEL_COMBO.set(content['label'][0])
             if "debug_mode" in content.keys():
                 self.DEBUG_MODE = content["debug_mode"]
+            if "MASK_CACHE_BYTES" in content.keys():
+                self.__mask_db__.CACHE.set_max_bytes(content["MASK_CACHE_BYTES"])
+            if "MEMORY_BUDGET_BYTES" in content.keys():
+                self.__budget__.BUDGET_BYTES = content["MEMORY_BUDGET_BYTES"]
+            if "GROW_TOLERANCE" in content.keys():
+                self.GROW_TOLERANCE = content["GROW_TOLERANCE"]
+            if "HISTORY_MAX_BYTES" in content.keys():
+                self.__history__.set_max_bytes(content["HISTORY_MAX_BYTES"])
+            if "record_events" in content.keys():
+                self.__record_path__ = content["record_events"]
 
         except OSError:
             messagebox.showwarning("setting.json not found", f"無法載入{WORKSPACE_DIR}/setting.json")
 
-    def __render_polygon_and_box__(self, img: cv2.Mat, bbox: tuple[int]):
+    def __render_polygon_and_box__(self, img: cv2.Mat, bbox: tuple[float]):
         """
         將多邊形和Mask的bounding box畫出來，作為ImageEditWindow的render callback
 
         Args:
-            img: 圖片
-            bbox: (x, y, w, h)
+            img: 縮放到widget尺寸的畫面
+            bbox: 可視範圍 (x, y, w, h)
         """
         close = self.__control__.SHOULD_CLOSE.get() == '1'
-        self.__polygon__.render(img, bbox, close)
+        pixel_size = bbox[2] / max(self.__img_edit__.winfo_width(), 1)  # 一個螢幕像素對應到原圖的幾個像素
+        self.__polygon__.render(img, bbox, close, pixel_size)
 
         if self.__control__.SHOULD_DRAW_MASK_BOX.get() == '1':
             self.__mask_db__.render(img, bbox)
@@ -239,6 +470,7 @@ class MainFrame(ttk.Frame):
         """
         self.__mask_db__.load_json(self.IMG_REL_PATH)
         self.__control__.reset_mask_list(self.__mask_db__.__database__)
+        self.__history__.clear()
 
     def save_mask(self, event: tk.Event = None):
         """
@@ -246,6 +478,14 @@ class MainFrame(ttk.Frame):
         """
         self.__mask_db__.write_json(self.IMG_REL_PATH)
 
+    def __close_recorder__(self, event: tk.Event = None):
+        """
+        關閉事件記錄檔（沒有在錄製時不做任何事）
+        """
+        if self.__recorder__ is not None:
+            self.__recorder__.close()
+            self.__recorder__ = None
+
     pass # end of class MainFrame
 
 def main():
@@ -257,8 +497,11 @@ def main():
         mainframe.pack(expand=True, fill=tk.BOTH)
 
         # 按鍵要綁在 root，不然 mainFrame 的 focus 可能會被其他按鈕搶走
-        root.bind("<Control-Key-z>", mainframe.__delete_last_polygon_point__)
+        root.bind("<Control-Key-z>", mainframe.HANDLERS["undo"])
+        root.bind("<Control-Key-y>", mainframe.HANDLERS["redo"])
+        root.bind("<Control-Shift-Key-Z>", mainframe.HANDLERS["redo"])
         root.bind("<Control-Key-s>", mainframe.save_mask)
+        root.bind("<Control-Key-m>", mainframe.export_memory_report)
         root.geometry("=1000x600+20+20")
 
     btn = ttk.Button(root, text="點我開始", command=setup_mainFrame)
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from typing import Hashable
+import numpy as np
+
+class MaskCache:
+    """
+    以位元組數為上限的LRU快取，用來存放由 "Mask" 欄位解碼出來的numpy陣列（以及著色後的圖塊）
+
+    當佔用的位元組數超過 MAX_BYTES 時，會從最久沒被用到的項目開始淘汰
+    """
+    MAX_BYTES: int      # 快取最多可以佔用幾個位元組
+    HITS: int           # 命中次數
+    MISSES: int         # 未命中次數
+    __entries__: OrderedDict[Hashable, np.ndarray]
+    """ key -> 陣列，越後面的項目代表越近被使用過 """
+    __nbytes__: int     # 目前所有項目佔用的位元組數
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """
+        初始化
+
+        Args:
+            max_bytes: 快取的位元組上限，預設256MB
+        """
+        self.MAX_BYTES = max_bytes
+        self.HITS = 0
+        self.MISSES = 0
+        self.__entries__ = OrderedDict()
+        self.__nbytes__ = 0
+
+    def get(self, key: Hashable) -> np.ndarray | None:
+        """
+        取出key對應的陣列，並將它標記為最近使用過
+
+        Return:
+            若不在快取中則回傳None
+        """
+        arr = self.__entries__.get(key)
+        if arr is None:
+            self.MISSES += 1
+            return None
+
+        self.HITS += 1
+        self.__entries__.move_to_end(key)
+        return arr
+
+    def put(self, key: Hashable, arr: np.ndarray):
+        """
+        將arr放進快取，必要時淘汰最久沒用到的項目
+
+        單一項目比 MAX_BYTES 還大時不會被放入
+        """
+        self.invalidate(key)
+        if arr.nbytes > self.MAX_BYTES:
+            return
+
+        self.__entries__[key] = arr
+        self.__nbytes__ += arr.nbytes
+        self.__evict__()
+
+    def invalidate(self, key: Hashable):
+        """
+        將key從快取中移除（不存在則不做任何事）
+        """
+        arr = self.__entries__.pop(key, None)
+        if arr is not None:
+            self.__nbytes__ -= arr.nbytes
+
+    def clear(self):
+        """
+        清空快取（命中次數不會被重設）
+        """
+        self.__entries__.clear()
+        self.__nbytes__ = 0
+
+    def set_max_bytes(self, max_bytes: int):
+        """
+        更改位元組上限，若目前已超出上限則立即淘汰
+        """
+        self.MAX_BYTES = max_bytes
+        self.__evict__()
+
+    def shrink_to(self, nbytes: int):
+        """
+        淘汰最久沒用到的項目，直到佔用不超過nbytes（MAX_BYTES不變）
+        """
+        while self.__nbytes__ > nbytes and len(self.__entries__) != 0:
+            _, arr = self.__entries__.popitem(last=False)
+            self.__nbytes__ -= arr.nbytes
+
+    def nbytes(self) -> int:
+        """
+        目前快取佔用的位元組數
+        """
+        return self.__nbytes__
+
+    def stats(self) -> dict:
+        """
+        回傳快取的統計資料，可用來調整 MAX_BYTES
+        """
+        total = self.HITS + self.MISSES
+        return {
+            "hits": self.HITS,
+            "misses": self.MISSES,
+            "hit_rate": self.HITS / total if total > 0 else 0.0,
+            "entries": len(self.__entries__),
+            "nbytes": self.__nbytes__,
+            "max_bytes": self.MAX_BYTES,
+        }
+
+    def __evict__(self):
+        """
+        從最久沒用到的項目開始淘汰，直到不超過 MAX_BYTES
+        """
+        self.shrink_to(self.MAX_BYTES)
+
+    pass # end of class MaskCache
@@ -1,8 +1,10 @@
+import math
 import cv2
 import numpy as np
 from tkinter import messagebox
 import os.path
 import json
+from mask_cache import MaskCache
 
 class MaskDatabase:
     """
@@ -12,9 +14,9 @@ class MaskDatabase:
     __database__: list[dict] 
     """ 每一個mask都以一個dict表示，其格式為 { "bbox": [x1, y1, x2, y2], "label": "標籤", "Mask": 二維的int陣列 } """
     __hilight_idx__: int     
-    """ 將要突顯的 mask 的 index 給快取起來 """ 
-    __hilight_img__: cv2.Mat | None 
-    """ 將要突顯的 mask 的 "Mask" 欄位給轉成圖片 """
+    """ 將要突顯的 mask 的 index 給快取起來，-1代表不突顯 """ 
+    CACHE: MaskCache
+    """ 解碼後的mask及著色後的圖塊，key為 (id(mask_data), "mask" 或 "tile") """
 
     def __init__(self):
         """
@@ -22,25 +24,68 @@ class MaskDatabase:
         """
         self.__database__ = list()
         self.__hilight_idx__ = -1
-        self.__hilight_img__ = None
+        self.CACHE = MaskCache()
 
-    def append(self, bbox: tuple[int], label: str, mask: list[list[int]]):
+    def append(self, bbox: tuple[int], label: str, mask: list[list[int]], mask_img: cv2.Mat | None = None):
         """
         新增一個mask進database
+
+        Args:
+            mask_img: 若已經有mask的圖片（即mask轉成numpy前的樣子），可以一併傳入，省下之後解碼的時間
+        """
+        mask_data = { "bbox": bbox, "label": label, "Mask": mask }
+        self.__database__.append(mask_data)
+
+        if mask_img is not None:
+            self.CACHE.put((id(mask_data), "mask"), mask_img)
+
+    def insert(self, idx: int, mask_data: dict):
         """
-        self.__database__.append({ "bbox": bbox, "label": label, "Mask": mask })
+        將mask_data（格式同 __database__ 中的元素）放回第idx個位置，用於復原刪除
+        """
+        self.__database__.insert(idx, mask_data)
+
+        # 調整突顯的 index
+        if self.__hilight_idx__ != -1 and idx <= self.__hilight_idx__:
+            self.__hilight_idx__ += 1
 
-    def delete(self, idx: int):
+    def delete(self, idx: int) -> dict:
         """
         刪掉第idx個mask
 
         Args:
             idx: index，0 -> 第一個
+
+        Return:
+            被刪掉的mask_data
         """
+        # 快取是以dict的id為key，dict被刪掉後id可能被重用，所以要一併移除
+        mask_data = self.__database__[idx]
+        self.__invalidate__(mask_data)
+
         # 刪掉第idx個
         # https://stackoverflow.com/a/627453/20876404
         del self.__database__[idx]
 
+        # 調整突顯的 index
+        if idx == self.__hilight_idx__:
+            self.__hilight_idx__ = -1
+        elif idx < self.__hilight_idx__:
+            self.__hilight_idx__ -= 1
+
+        return mask_data
+
+    def set_label(self, idx: int, label: str) -> str:
+        """
+        更改第idx個mask的標籤
+
+        Return:
+            原本的標籤
+        """
+        old_label = self.__database__[idx]["label"]
+        self.__database__[idx]["label"] = label
+        return old_label
+
     def query(self, idx: int):
         """
         查找database中第idx個
@@ -50,6 +95,59 @@ class MaskDatabase:
         """
         return self.__database__[idx]
 
+    def get_mask(self, idx: int) -> cv2.Mat:
+        """
+        取得第idx個mask的圖片（shape = H * W，dtype = uint8），會優先從快取中取出
+
+        回傳的陣列與快取共用，不要直接修改它
+        """
+        mask_data = self.__database__[idx]
+        key = (id(mask_data), "mask")
+
+        mask = self.CACHE.get(key)
+        if mask is None:
+            mask = np.array(mask_data["Mask"], dtype=np.uint8)
+            self.CACHE.put(key, mask)
+        return mask
+
+    def get_tile(self, idx: int) -> cv2.Mat:
+        """
+        取得第idx個mask著色後的圖塊（shape = H * W * 3），mask的區域為紅色，其餘為黑色
+
+        回傳的陣列與快取共用，不要直接修改它
+        """
+        mask_data = self.__database__[idx]
+        key = (id(mask_data), "tile")
+
+        tile = self.CACHE.get(key)
+        if tile is None:
+            mask = self.get_mask(idx)
+            tile = np.zeros((*mask.shape, 3), np.uint8)
+            tile[:, :, 0][mask > 0] = 255
+            self.CACHE.put(key, tile)
+        return tile
+
+    def list_nbytes(self) -> int:
+        """
+        所有 "Mask" 欄位（list of list of int）佔用的記憶體（估計值）
+
+        每個list有56 bytes的overhead，每個元素是8 bytes的pointer（小整數本身是共用的）
+        """
+        total = 0
+        for mask_data in self.__database__:
+            mask = mask_data["Mask"]
+            if mask is None or len(mask) == 0:
+                continue
+            total += 56 + len(mask) * (8 + 56 + 8 * len(mask[0]))
+        return total
+
+    def __invalidate__(self, mask_data: dict):
+        """
+        將mask_data在快取中的所有項目移除
+        """
+        self.CACHE.invalidate((id(mask_data), "mask"))
+        self.CACHE.invalidate((id(mask_data), "tile"))
+
     # 繪製 ##################################################################################################################
 
     def set_highlight(self, idx: int):
@@ -61,26 +159,24 @@ class MaskDatabase:
         """
         # check if in range
         if idx in range(len(self.__database__)):
-            # already in the cache
-            if idx == self.__hilight_idx__:
-                return
-            else:
-                self.__hilight_idx__ = idx
-                self.__hilight_img__ = np.array(self.__database__[idx]["Mask"], dtype=np.uint8)
+            self.__hilight_idx__ = idx
+            # 先把著色的圖塊放進快取，render時就不用再解碼
+            self.get_tile(idx)
         else:
             self.__hilight_idx__ = -1
-            self.__hilight_img__ = None
 
-    def render(self, img: cv2.Mat, bbox: tuple[int]):
+    def render(self, img: cv2.Mat, bbox: tuple[float]):
         """
         將database中所有mask的bounding box畫出來
 
         Args:
-            img: 要畫在哪個圖片上
-            bbox: img在原圖中的位置(x, y, w, h)
+            img: 要畫在哪個圖片上，涵蓋原圖中bbox的範圍，尺寸可以和bbox不同（會依比例縮放）
+            bbox: img在原圖中的位置(x, y, w, h)，可以是浮點數
         """
         x, y, w, h = bbox
-        thick = int(np.max((w * 0.001, h * 0.001, 1)))
+        img_h, img_w = img.shape[:2]
+        sx, sy = img_w / w, img_h / h   # 原圖座標 -> img座標
+        thick = int(np.max((img_w * 0.001, img_h * 0.001, 1)))
 
         # 對於每個mask
         for mask_data in self.__database__:
@@ -89,24 +185,36 @@ class MaskDatabase:
 
             # 繪製時要將座標轉成相對於可視範圍的左上角
             # 因為mask是位在 x 屬於 [x1, x2) 且 y 屬於 [y1, y2) 的區域，所以右下角的座標要減一
-            cv2.rectangle(img, (x1 - x, y1 - y), (x2 - x - 1, y2 - y - 1), (191, 93, 2), thickness=thick, lineType=cv2.LINE_AA)
+            p1 = (round((x1 - x) * sx), round((y1 - y) * sy))
+            p2 = (round((x2 - x) * sx) - 1, round((y2 - y) * sy) - 1)
+            cv2.rectangle(img, p1, p2, (191, 93, 2), thickness=thick, lineType=cv2.LINE_AA)
 
-        if self.__hilight_img__ is not None:
+        if self.__hilight_idx__ != -1:
             x1, y1, x2, y2 = self.__database__[self.__hilight_idx__]['bbox']
 
-            # 將 mask 圖片偏移，使得它的位置相對於 viewport 的左上角
-            affine_mask = cv2.warpAffine(self.__hilight_img__, np.array([[1, 0, x1 - x], [0, 1, y1 - y]], np.float32), (w, h))
+            # 只處理 mask 的 bounding box 和可視範圍重疊的部份（以整數像素計）
+            ix1, iy1 = max(x1, math.floor(x)), max(y1, math.floor(y))
+            ix2, iy2 = min(x2, math.ceil(x + w)), min(y2, math.ceil(y + h))
+            if ix1 >= ix2 or iy1 >= iy2:
+                return
+
+            # 重疊的部份在img中的位置：img的像素 u 的中心對應到原圖的 x + (u + 0.5) / sx
+            rx1, ry1 = max(math.ceil((ix1 - x) * sx - 0.5), 0), max(math.ceil((iy1 - y) * sy - 0.5), 0)
+            rx2, ry2 = min(math.ceil((ix2 - x) * sx - 0.5), img_w), min(math.ceil((iy2 - y) * sy - 0.5), img_h)
+            if rx1 >= rx2 or ry1 >= ry2:
+                return
 
-            # 將 mask 的區域，弄成紅色
-            img_cpy = img.copy()
-            color = np.zeros(img.shape, np.uint8)
-            color[:, :, 0] = 255
-            # 透過 mask 來指定只對特定區域做 bitwise_and，而輸出結果直接寫回 img_cpy
-            # 因為有指定 mask，所以只有該區域會被寫回 img_cpy
-            cv2.bitwise_and(color, color, mask=affine_mask, dst=img_cpy)
+            # img每個像素對應到mask的哪個像素（nearest neighbor），和畫面的縮放方式一致
+            cols = np.clip(np.floor(x + (np.arange(rx1, rx2) + 0.5) / sx).astype(np.int64) - x1, ix1 - x1, ix2 - x1 - 1)
+            rows = np.clip(np.floor(y + (np.arange(ry1, ry2) + 0.5) / sy).astype(np.int64) - y1, iy1 - y1, iy2 - y1 - 1)
+            index = np.ix_(rows, cols)
+            mask = self.get_mask(self.__hilight_idx__)[index]
+            tile = self.get_tile(self.__hilight_idx__)[index]
+            roi = img[ry1 : ry2, rx1 : rx2]
 
-            # 將「原圖」和「mask區域被改成紅色的圖」相疊
-            cv2.addWeighted(img, 0.5, img_cpy, 0.5, 0, dst=img)            
+            # 將「原圖」和「紅色圖塊」相疊，並只寫回 mask 的區域
+            blend = cv2.addWeighted(roi, 0.5, tile, 0.5, 0)
+            np.copyto(roi, blend, where=(mask > 0)[:, :, np.newaxis])
 
     # 存讀檔 ####################################################################################################
 
@@ -121,6 +229,9 @@ class MaskDatabase:
         JSON_PATH = f'{img_path}.json'
         basename = os.path.basename(img_path)
 
+        self.__hilight_idx__ = -1
+        self.CACHE.clear()
+
         if not os.path.exists(JSON_PATH):
             messagebox.showinfo("File Not Found", f'{JSON_PATH} 不存在，一切將從零開始')
             self.__database__.clear()
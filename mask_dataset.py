@@ -0,0 +1,193 @@
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Iterator
+import hashlib
+import json
+import os
+import os.path
+import cv2
+import numpy as np
+
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+def find_json(ROOT_DIR: str) -> list[str]:
+    """
+    找出 ROOT_DIR（含子資料夾）下所有的 `{圖片}.json`，不管圖片是否存在
+
+    Return:
+        json路徑的列表，依路徑排序
+    """
+    paths = []
+    for dirpath, _, filenames in os.walk(ROOT_DIR):
+        for name in filenames:
+            if name.lower().endswith('.json') and name[:-len('.json')].lower().endswith(IMG_EXTS):
+                paths.append(os.path.join(dirpath, name))
+    paths.sort()
+    return paths
+
+def find_pairs(ROOT_DIR: str) -> list[tuple[str, str]]:
+    """
+    找出 ROOT_DIR（含子資料夾）下所有有對應標記結果的圖片
+
+    Return:
+        [(圖片路徑, json路徑), ...]，依路徑排序
+    """
+    return [(JSON_PATH[:-len('.json')], JSON_PATH) for JSON_PATH in find_json(ROOT_DIR) if os.path.exists(JSON_PATH[:-len('.json')])]
+
+def parse_json(JSON_PATH: str) -> tuple[np.ndarray, list[str], list[np.ndarray]]:
+    """
+    讀取 `{img}.json`，將 "Mask" 轉成numpy
+
+    Return:
+        (bboxes, labels, masks): bboxes 是 n * 4 的int32陣列 (x1, y1, x2, y2)；masks 是bbox內的uint8陣列，順序依流水號排列
+    """
+    with open(JSON_PATH, 'rt') as f:
+        content = json.load(f)
+
+    basename = os.path.basename(JSON_PATH)[:-len('.json')]
+    mask_data = content[basename]
+    keys = sorted(mask_data.keys(), key=int)
+
+    bboxes = np.array([mask_data[k]['bbox'] for k in keys], dtype=np.int32).reshape((-1, 4))
+    labels = [mask_data[k]['label'] for k in keys]
+    masks = [np.array(mask_data[k]['Mask'], dtype=np.uint8) for k in keys]
+    return bboxes, labels, masks
+
+def load_instances(JSON_PATH: str, CACHE_DIR: str | None = None) -> tuple[np.ndarray, list[str], list[np.ndarray]]:
+    """
+    和 parse_json 一樣，但若有指定 CACHE_DIR，會把解碼後的結果以 npz 存起來，json沒有變動時直接讀取 npz
+
+    npz 的內容：bboxes (n * 4)、labels (n)、shapes (n * 2)、offsets (n + 1)、data（所有mask攤平後串起來）、source（json的 [大小, mtime_ns]）
+    """
+    if CACHE_DIR is None:
+        return parse_json(JSON_PATH)
+
+    st = os.stat(JSON_PATH)
+    source = np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+    key = hashlib.sha1(os.path.abspath(JSON_PATH).encode('utf-8')).hexdigest()
+    CACHE_PATH = os.path.join(CACHE_DIR, f'{key}.npz')
+
+    # cache hit
+    if os.path.exists(CACHE_PATH):
+        with np.load(CACHE_PATH) as npz:
+            if np.array_equal(npz['source'], source):
+                data, offsets, shapes = npz['data'], npz['offsets'], npz['shapes']
+                masks = [data[offsets[i] : offsets[i + 1]].reshape(shapes[i]) for i in range(len(shapes))]
+                return npz['bboxes'], npz['labels'].tolist(), masks
+
+    # cache miss
+    bboxes, labels, masks = parse_json(JSON_PATH)
+    shapes = np.array([m.shape for m in masks], dtype=np.int64).reshape((-1, 2))
+    offsets = np.concatenate(([0], np.cumsum([m.size for m in masks], dtype=np.int64)))
+    data = np.concatenate([m.ravel() for m in masks]) if len(masks) != 0 else np.zeros(0, np.uint8)
+
+    # 先寫到暫存檔再改名，避免多個worker同時寫入時讀到寫一半的檔案
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    TMP_PATH = f'{CACHE_PATH}.{os.getpid()}.tmp.npz'
+    np.savez(TMP_PATH, bboxes=bboxes, labels=np.array(labels, dtype=str), shapes=shapes, offsets=offsets, data=data, source=source)
+    os.replace(TMP_PATH, CACHE_PATH)
+
+    return bboxes, labels, masks
+
+def load_sample(IMG_PATH: str, JSON_PATH: str, crop: bool = True, CACHE_DIR: str | None = None) -> tuple[np.ndarray, list[dict]]:
+    """
+    讀取一組圖片和標記結果
+
+    Args:
+        crop: True -> mask 為 bbox 內的陣列；False -> mask 為和圖片一樣大的陣列
+        CACHE_DIR: 見 load_instances
+
+    Return:
+        (image, instances): image 為 RGB 圖片；instances 為 [{ "bbox": (x1, y1, x2, y2), "label": 標籤, "mask": uint8陣列 }, ...]
+    """
+    # 解決路徑中有Unicode字元時cv2.imread失敗的問題
+    image = cv2.imdecode(np.fromfile(IMG_PATH, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f'無法開啟圖片 "{IMG_PATH}"')
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    H, W = image.shape[:2]
+
+    bboxes, labels, masks = load_instances(JSON_PATH, CACHE_DIR)
+
+    instances = []
+    for (x1, y1, x2, y2), label, mask in zip(bboxes.tolist(), labels, masks):
+        if not crop:
+            # 將 bbox 內的 mask 貼到整張圖上，超出圖片的部份捨去
+            full = np.zeros((H, W), np.uint8)
+            cx1, cy1, cx2, cy2 = max(x1, 0), max(y1, 0), min(x2, W), min(y2, H)
+            if cx1 < cx2 and cy1 < cy2:
+                full[cy1:cy2, cx1:cx2] = mask[cy1 - y1 : cy2 - y1, cx1 - x1 : cx2 - x1]
+            mask = full
+        instances.append({ "bbox": (x1, y1, x2, y2), "label": label, "mask": mask })
+
+    return image, instances
+
+
+class MaskDataset:
+    """
+    走訪資料夾中所有的 圖片 + `{圖片}.json`，產生 (image, instances)，可以直接當作訓練資料的來源
+
+    ```
+    for image, instances in MaskDataset("workspace/", workers=8):
+        ...
+    ```
+    """
+    PAIRS: list[tuple[str, str]]   # [(圖片路徑, json路徑), ...]
+    CROP: bool                     # mask 是否只包含 bbox 內的範圍
+    CACHE_DIR: str | None          # 解碼後的mask存放的位置，None代表不快取
+    WORKERS: int                   # 預先載入用的 worker 數量
+    PREFETCH: int                  # 最多預先載入幾組
+    USE_PROCESSES: bool            # True -> process pool；False -> thread pool
+
+    def __init__(self, ROOT_DIR: str, crop: bool = True, workers: int = 4, prefetch: int = 8, use_processes: bool = False, cache_dir: str | None = None):
+        """
+        初始化
+
+        Args:
+            ROOT_DIR: 放圖片和json的資料夾（會搜尋子資料夾）
+            crop: True -> mask 為 bbox 內的陣列；False -> mask 和圖片一樣大
+            workers: 預先載入用的 worker 數量，0 代表在呼叫端的執行緒載入
+            prefetch: 最多預先載入幾組
+            use_processes: 是否使用 process pool（json解析較重時可以避開GIL）
+            cache_dir: 將解碼後的mask存成npz的資料夾，None代表不快取
+        """
+        self.PAIRS = find_pairs(ROOT_DIR)
+        self.CROP = crop
+        self.CACHE_DIR = cache_dir
+        self.WORKERS = workers
+        self.PREFETCH = max(prefetch, 1)
+        self.USE_PROCESSES = use_processes
+
+    def __len__(self) -> int:
+        return len(self.PAIRS)
+
+    def __getitem__(self, idx: int) -> tuple[np.ndarray, list[dict]]:
+        IMG_PATH, JSON_PATH = self.PAIRS[idx]
+        return load_sample(IMG_PATH, JSON_PATH, self.CROP, self.CACHE_DIR)
+
+    def __iter__(self) -> Iterator[tuple[np.ndarray, list[dict]]]:
+        """
+        依序產生 (image, instances)，同時讓 worker 預先載入後面 PREFETCH 組
+        """
+        if self.WORKERS == 0:
+            for i in range(len(self)):
+                yield self[i]
+            return
+
+        pool: Executor = (ProcessPoolExecutor if self.USE_PROCESSES else ThreadPoolExecutor)(max_workers=self.WORKERS)
+        with pool:
+            pending = deque()
+            try:
+                for IMG_PATH, JSON_PATH in self.PAIRS:
+                    pending.append(pool.submit(load_sample, IMG_PATH, JSON_PATH, self.CROP, self.CACHE_DIR))
+                    if len(pending) >= self.PREFETCH:
+                        yield pending.popleft().result()
+
+                while len(pending) != 0:
+                    yield pending.popleft().result()
+            finally:
+                # 呼叫端提早結束迭代時，不要再載入剩下的
+                for future in pending:
+                    future.cancel()
+
+    pass # end of class MaskDataset
@@ -0,0 +1,194 @@
+"""
+遮罩的布林運算（聯集、相減、依z-order解決重疊）
+
+所有運算都在 bbox 內的陣列上進行，不會為每個mask配置整張圖大小的畫布。
+instance 的格式和 mask_dataset.load_sample 相同：{ "bbox": (x1, y1, x2, y2), "label": 標籤, "mask": uint8陣列（bbox內，>0為前景） }
+輸出的 mask 為 0 / 255
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import os.path
+import numpy as np
+from mask_dataset import find_pairs, parse_json
+
+def tighten(bbox: tuple[int], mask: np.ndarray) -> tuple[tuple[int], np.ndarray] | tuple[None, None]:
+    """
+    將 bbox 縮到剛好包住前景
+
+    Return:
+        (bbox, mask)，沒有前景時回傳 (None, None)
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None, None
+    cols = np.flatnonzero(mask.any(axis=0))
+
+    x1, y1 = bbox[0], bbox[1]
+    r1, r2, c1, c2 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    return (int(x1 + c1), int(y1 + r1), int(x1 + c2), int(y1 + r2)), mask[r1:r2, c1:c2]
+
+def union(bboxes: np.ndarray, masks: list[np.ndarray]) -> tuple[tuple[int], np.ndarray] | tuple[None, None]:
+    """
+    將數個mask聯集，畫布只有所有bbox的聯集那麼大
+
+    Args:
+        bboxes: n * 4 (x1, y1, x2, y2)
+        masks: 每個bbox內的mask
+    """
+    bboxes = np.asarray(bboxes, dtype=np.int64).reshape((-1, 4))
+    if len(bboxes) == 0:
+        return None, None
+
+    ux1, uy1 = bboxes[:, :2].min(axis=0)
+    ux2, uy2 = bboxes[:, 2:].max(axis=0)
+    canvas = np.zeros((uy2 - uy1, ux2 - ux1), dtype=bool)
+
+    for (x1, y1, x2, y2), mask in zip(bboxes.tolist(), masks):
+        region = canvas[y1 - uy1 : y2 - uy1, x1 - ux1 : x2 - ux1]
+        np.logical_or(region, mask > 0, out=region)
+
+    return tighten((int(ux1), int(uy1), int(ux2), int(uy2)), canvas.astype(np.uint8) * 255)
+
+def subtract(bbox: tuple[int], mask: np.ndarray, other_bbox: tuple[int], other_mask: np.ndarray) -> tuple[tuple[int], np.ndarray] | tuple[None, None]:
+    """
+    mask - other_mask，只處理兩個bbox重疊的部份
+
+    Return:
+        相減並縮小bbox後的 (bbox, mask)，沒有剩下前景時回傳 (None, None)
+    """
+    x1, y1, x2, y2 = bbox
+    ox1, oy1, ox2, oy2 = other_bbox
+    ix1, iy1, ix2, iy2 = max(x1, ox1), max(y1, oy1), min(x2, ox2), min(y2, oy2)
+
+    result = (mask > 0).astype(np.uint8) * 255
+    if ix1 < ix2 and iy1 < iy2:
+        cut = other_mask[iy1 - oy1 : iy2 - oy1, ix1 - ox1 : ix2 - ox1] > 0
+        result[iy1 - y1 : iy2 - y1, ix1 - x1 : ix2 - x1][cut] = 0
+
+    return tighten(bbox, result)
+
+def overlapping(bboxes: np.ndarray, bbox: tuple[int]) -> np.ndarray:
+    """
+    bboxes（n * 4）中哪些和 bbox 有重疊
+
+    Return:
+        長度n的bool陣列
+    """
+    x1, y1, x2, y2 = bbox
+    return (bboxes[:, 0] < x2) & (bboxes[:, 2] > x1) & (bboxes[:, 1] < y2) & (bboxes[:, 3] > y1)
+
+def union_by_label(instances: list[dict]) -> list[dict]:
+    """
+    將同一個標籤的所有mask合併成一個，順序依各標籤第一次出現的順序
+    """
+    groups: dict[str, list[int]] = dict()
+    for i, inst in enumerate(instances):
+        groups.setdefault(inst["label"], []).append(i)
+
+    result = []
+    for label, indices in groups.items():
+        bbox, mask = union([instances[i]["bbox"] for i in indices], [instances[i]["mask"] for i in indices])
+        if bbox is not None:
+            result.append({ "bbox": bbox, "label": label, "mask": mask })
+    return result
+
+def subtract_from_others(instances: list[dict], idx: int) -> list[dict]:
+    """
+    將第idx個mask從其他所有mask中扣掉，扣完沒有前景的會被移除
+    """
+    bboxes = np.array([inst["bbox"] for inst in instances], dtype=np.int64).reshape((-1, 4))
+    hit = overlapping(bboxes, instances[idx]["bbox"])
+
+    result = []
+    for i, inst in enumerate(instances):
+        if i == idx or not hit[i]:
+            result.append(inst)
+            continue
+        bbox, mask = subtract(inst["bbox"], inst["mask"], instances[idx]["bbox"], instances[idx]["mask"])
+        if bbox is not None:
+            result.append({ "bbox": bbox, "label": inst["label"], "mask": mask })
+    return result
+
+def resolve_overlaps(instances: list[dict], z_order: list[int] | None = None) -> list[dict]:
+    """
+    依z-order解決重疊：每個像素只屬於z最大的mask，被完全蓋住的mask會被移除，其餘順序不變
+
+    Args:
+        z_order: 每個mask的z值，None代表依流水號（越後面越上層）
+    """
+    n = len(instances)
+    z = np.arange(n) if z_order is None else np.asarray(z_order)
+    bboxes = np.array([inst["bbox"] for inst in instances], dtype=np.int64).reshape((-1, 4))
+
+    result = []
+    for i, inst in enumerate(instances):
+        # 只有bbox有重疊且在上層的mask才需要扣掉
+        above = np.flatnonzero(overlapping(bboxes, inst["bbox"]) & (z > z[i]))
+
+        bbox, mask = inst["bbox"], inst["mask"]
+        for j in above:
+            bbox, mask = subtract(bbox, mask, instances[j]["bbox"], instances[j]["mask"])
+            if bbox is None:
+                break
+
+        if bbox is not None:
+            result.append({ "bbox": bbox, "label": inst["label"], "mask": mask })
+    return result
+
+def label_priority_order(instances: list[dict], priority: list[str]) -> list[int]:
+    """
+    依標籤決定z值：priority 由下層排到上層，不在 priority 中的標籤在最下層；同一層內依流水號
+
+    Return:
+        每個mask的z值
+    """
+    rank = [priority.index(inst["label"]) + 1 if inst["label"] in priority else 0 for inst in instances]
+    order = sorted(range(len(instances)), key=lambda i: (rank[i], i))
+    z = [0] * len(instances)
+    for zi, i in enumerate(order):
+        z[i] = zi
+    return z
+
+def process_file(JSON_PATH: str, ROOT_DIR: str, OUT_DIR: str, op: str, priority: list[str]) -> str:
+    """
+    對一個 `{img}.json` 做 union 或 resolve，輸出到 OUT_DIR 下和它相對於 ROOT_DIR 相同的位置（保留子資料夾，避免同名檔案互相覆蓋）
+    """
+    bboxes, labels, masks = parse_json(JSON_PATH)
+    instances = [{ "bbox": tuple(b), "label": l, "mask": m } for b, l, m in zip(bboxes.tolist(), labels, masks)]
+
+    if op == "union":
+        instances = union_by_label(instances)
+    else:
+        instances = resolve_overlaps(instances, label_priority_order(instances, priority))
+
+    name = os.path.basename(JSON_PATH)
+    basename = name[:-len('.json')]
+    out_data = { basename: {
+        str(i): { "bbox": list(inst["bbox"]), "label": inst["label"], "Mask": inst["mask"].tolist() } for i, inst in enumerate(instances)
+    } }
+
+    OUT_PATH = os.path.join(OUT_DIR, os.path.relpath(JSON_PATH, ROOT_DIR))
+    os.makedirs(os.path.dirname(OUT_PATH), exist_ok=True)
+    with open(OUT_PATH, 'wt') as f:
+        json.dump(out_data, f)
+    return f'寫入 {OUT_PATH}，{len(masks)} -> {len(instances)} 個遮罩'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="對資料夾中所有的標記結果做遮罩運算。union: 同標籤的遮罩合併；resolve: 依z-order移除重疊")
+    parser.add_argument("root_dir", help="放圖片和json的資料夾（會搜尋子資料夾）")
+    parser.add_argument("out_dir", help="輸出的資料夾（不會覆寫原本的json）")
+    parser.add_argument("--op", choices=["union", "resolve"], default="resolve")
+    parser.add_argument("--priority", nargs="*", default=[], help="resolve時的標籤順序，由下層排到上層；未列出的標籤在最下層")
+    parser.add_argument("--workers", type=int, default=None, help="process的數量，預設使用所有CPU")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    paths = [JSON_PATH for _, JSON_PATH in find_pairs(args.root_dir)]
+    n = len(paths)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for msg in pool.map(process_file, paths, [args.root_dir] * n, [args.out_dir] * n, [args.op] * n, [args.priority] * n, chunksize=8):
+            print(msg)
@@ -0,0 +1,76 @@
+from typing import Callable
+
+class MemoryBudget:
+    """
+    記錄各部份（圖片、遮罩、快取……）佔用的記憶體，並在總量超過 BUDGET_BYTES 時，要求可以淘汰的部份釋放記憶體
+
+    每個部份以一個名稱和一個回傳位元組數的函式登記；可以淘汰的部份另外提供 shrink(目標位元組數)，
+    淘汰的順序和登記的順序相同
+    """
+    BUDGET_BYTES: int | None                            # 記憶體預算，None代表不限制
+    __sources__: dict[str, Callable[[], int]]           # 名稱 -> 目前佔用的位元組數
+    __shrinkers__: list[tuple[str, Callable[[int], None]]] # (名稱, 將該部份縮減到指定位元組數以下的函式)
+
+    def __init__(self, budget_bytes: int | None = None):
+        """
+        初始化
+
+        Args:
+            budget_bytes: 記憶體預算，None代表不限制
+        """
+        self.BUDGET_BYTES = budget_bytes
+        self.__sources__ = dict()
+        self.__shrinkers__ = list()
+
+    def add_source(self, name: str, nbytes: Callable[[], int], shrink: Callable[[int], None] | None = None):
+        """
+        登記一個會佔用記憶體的部份
+
+        Args:
+            name: 名稱，會出現在報告中
+            nbytes: 回傳目前佔用的位元組數
+            shrink: 若可以淘汰，傳入將其縮減到指定位元組數以下的函式
+        """
+        self.__sources__[name] = nbytes
+        if shrink is not None:
+            self.__shrinkers__.append((name, shrink))
+
+    def report(self) -> dict:
+        """
+        各部份佔用的位元組數
+
+        Return:
+            { "sources": { 名稱: 位元組數 }, "total": 總和, "budget": BUDGET_BYTES }
+        """
+        sources = { name: int(nbytes()) for name, nbytes in self.__sources__.items() }
+        return { "sources": sources, "total": sum(sources.values()), "budget": self.BUDGET_BYTES }
+
+    def total(self) -> int:
+        """
+        所有部份佔用的位元組數總和
+        """
+        return sum(int(nbytes()) for nbytes in self.__sources__.values())
+
+    def enforce(self) -> bool:
+        """
+        若總量超過預算，依登記順序要求可以淘汰的部份釋放記憶體，直到不超過預算
+
+        Return:
+            是否有淘汰任何東西
+        """
+        if self.BUDGET_BYTES is None:
+            return False
+
+        total = self.total()
+        if total <= self.BUDGET_BYTES:
+            return False
+
+        for name, shrink in self.__shrinkers__:
+            current = int(self.__sources__[name]())
+            shrink(max(current - (total - self.BUDGET_BYTES), 0))
+            total = self.total()
+            if total <= self.BUDGET_BYTES:
+                break
+        return True
+
+    pass # end of class MemoryBudget
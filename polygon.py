@@ -5,57 +5,92 @@ class Polygon:
     """
     在視窗上可供編輯的多邊形
     """
-    __points__: list[list[int]]    # n * 2的陣列，每一列包含一個點 (x, y)
+    LOD_TOLERANCE: float = 1.0     # 縮小檢視時，簡化多邊形所容許的誤差（以螢幕像素計），<= 0 代表不簡化
+    LOD_MIN_POINTS: int = 64       # 點數少於此值時不簡化
+    __buffer__: np.ndarray         # capacity * 2 的陣列，前 __count__ 列為實際的點 (x, y)，空間不夠時容量加倍
+    __count__: int                 # 點的數量
 
     def __init__(self):
         """
         初始化
         """
-        self.__points__ = list()
+        self.__buffer__ = np.empty((16, 2), dtype=np.int32)
+        self.__count__ = 0
 
     def addPoint(self, x: int, y: int):
         """
         新增一個點
         """
-        self.__points__.append([x, y])
+        if self.__count__ == self.__buffer__.shape[0]:
+            new_buffer = np.empty((self.__buffer__.shape[0] * 2, 2), dtype=np.int32)
+            new_buffer[:self.__count__] = self.__buffer__
+            self.__buffer__ = new_buffer
+
+        self.__buffer__[self.__count__] = (x, y)
+        self.__count__ += 1
 
     def popPoint(self):
         """
         刪掉最後加入的一個點
         """
-        if len(self.__points__) != 0:
-            self.__points__.pop()
+        if self.__count__ != 0:
+            self.__count__ -= 1
 
     def clear(self):
         """
         清空
         """
-        self.__points__.clear()
+        self.__count__ = 0
+
+    def points(self) -> np.ndarray:
+        """
+        所有的點，shape = n * 2 (x, y)。回傳的是內部buffer的view，不要直接修改它
+        """
+        return self.__buffer__[:self.__count__]
 
     # 繪製 #################################################################################################################
 
-    def render(self, img: cv2.Mat, bbox: tuple[int], close: bool):
+    def render(self, img: cv2.Mat, bbox: tuple[float], close: bool, pixel_size: float = 1.0):
         """
         將所有點畫到img上
 
         Args:
-            img: 繪製的圖片
-            bbox: bounding box (x, y, w, h)
+            img: 繪製的圖片，涵蓋原圖中bbox的範圍，尺寸可以和bbox不同（會依比例縮放）
+            bbox: bounding box (x, y, w, h)，可以是浮點數
             close: 是否繪製封閉曲線
+            pixel_size: 一個螢幕像素對應到原圖的幾個像素，> 1 代表縮小檢視，此時會簡化多邊形
         """
-        pts = np.array(self.__points__, dtype=np.int32)
-        pts = pts.reshape((-1, 1, 2))  # 調成 n * 1 * 2
+        if self.__count__ == 0:
+            return
 
         x, y, w, h = bbox
-        thick = int(np.max((w * 0.001, h * 0.001, 1)))
+        img_h, img_w = img.shape[:2]
+        scale = np.array([img_w / w, img_h / h])  # 原圖座標 -> img座標
+        thick = int(np.max((img_w * 0.001, img_h * 0.001, 1)))
 
-        pts[:, :, 0] -= x   # 移動，使每一個點的座標變成相對於bbox的左上角
-        pts[:, :, 1] -= y
+        # 移動並縮放，使每一個點的座標變成相對於img的左上角，點畫在像素的中心（放大檢視時才會落在該像素上）
+        pts = np.round((self.points() + 0.5 - np.array([x, y])) * scale - 0.5).astype(np.int32)
+        pts = pts.reshape((-1, 1, 2))  # 調成 n * 1 * 2
+
+        # 縮小檢視時，小於 LOD_TOLERANCE 個螢幕像素的細節看不出來，用 Douglas-Peucker 簡化
+        line_pts = pts
+        if self.LOD_TOLERANCE > 0 and pixel_size > 1 and self.__count__ >= self.LOD_MIN_POINTS:
+            line_pts = cv2.approxPolyDP(pts, self.LOD_TOLERANCE * pixel_size * scale[0], close)
+
+        cv2.polylines(img, [line_pts], close, (0, 0, 255), thick, cv2.LINE_AA)
 
-        cv2.polylines(img, [pts], close, (0, 0, 255), thick, cv2.LINE_AA)
+        # 只畫出在可視範圍內的頂點
+        r = thick * 3
+        pts = pts[:, 0]
+        visible = (pts[:, 0] >= -r) & (pts[:, 0] < img_w + r) & (pts[:, 1] >= -r) & (pts[:, 1] < img_h + r)
+        pts = pts[visible]
+        if pts.shape[0] == 0:
+            return
 
-        for i in range(pts.shape[0]):
-            cv2.circle(img, pts[i, 0], thick * 3, (255, 0, 0), thick)
+        # 將每個頂點的圓圈近似成小多邊形，一次用 polylines 全部畫完
+        circle = cv2.ellipse2Poly((0, 0), (r, r), 0, 0, 360, 30)      # k * 2
+        markers = pts[:, np.newaxis, :] + circle[np.newaxis, :, :]   # n * k * 2
+        cv2.polylines(img, list(markers), True, (255, 0, 0), thick)
 
     # 轉換成輸出格式 ########################################################################################################
 
@@ -67,10 +102,10 @@ class Polygon:
             (bbox, mask_img): bbox是(x1, y1, x2, y2)，而mask_img是一張黑白圖片（shape = H * W）白色為遮罩，
                               如果polygon沒有3個點則回傳None
         """
-        if len(self.__points__) < 3:
+        if self.__count__ < 3:
             return None, None
 
-        pts = np.array(self.__points__, dtype=np.int32)
+        pts = self.points().copy()
         pts = pts.reshape((-1, 1, 2))
 
         x, y, w, h = cv2.boundingRect(pts)
@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+
+def flood_fill_mask(img: cv2.Mat, seed: tuple[int, int], tolerance: float) -> cv2.Mat:
+    """
+    從seed開始做flood fill，顏色和seed相差在tolerance以內的相連區域即為遮罩
+
+    Args:
+        img: RGB圖片（通常是可視範圍附近的ROI）
+        seed: (x, y)，相對於img的左上角
+        tolerance: 每個通道容許的差異
+
+    Return:
+        和img一樣大的黑白圖片，白色為遮罩
+    """
+    # 先模糊，避免雜訊讓區域斷掉
+    smooth = cv2.GaussianBlur(img, (5, 5), 0)
+
+    h, w = img.shape[:2]
+    fill_mask = np.zeros((h + 2, w + 2), np.uint8)
+    flags = 4 | cv2.FLOODFILL_MASK_ONLY | cv2.FLOODFILL_FIXED_RANGE | (255 << 8)
+    diff = (tolerance,) * 3
+    cv2.floodFill(smooth, fill_mask, seed, (0, 0, 0), diff, diff, flags)
+
+    # 補上小破洞
+    mask = fill_mask[1:-1, 1:-1]
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+def mask_to_polygon(mask: cv2.Mat, seed: tuple[int, int], epsilon: float = 1.0) -> np.ndarray | None:
+    """
+    取出包含seed的外輪廓，並用Douglas-Peucker簡化
+
+    Args:
+        mask: 黑白圖片
+        seed: (x, y)
+        epsilon: 簡化時容許的誤差（像素）
+
+    Return:
+        n * 2 的int32陣列，找不到時回傳None
+    """
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    seed = (float(seed[0]), float(seed[1]))
+
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        if cv2.pointPolygonTest(contour, seed, False) >= 0:
+            pts = cv2.approxPolyDP(contour, epsilon, True).reshape((-1, 2))
+            return pts if len(pts) >= 3 else None
+    return None
+
+def propose_polygon(img: cv2.Mat, scale: int, roi: tuple[int], seed: tuple[int, int], tolerance: float) -> np.ndarray | None:
+    """
+    在金字塔的某一層上，於roi範圍內從seed長出區域，並回傳原圖座標的多邊形
+
+    Args:
+        img: 金字塔的某一層（原圖縮小scale倍）
+        scale: 該層縮小的倍數
+        roi: 要處理的範圍 (x1, y1, x2, y2)，原圖座標
+        seed: (x, y)，原圖座標
+        tolerance: 見 flood_fill_mask
+
+    Return:
+        n * 2 的多邊形（原圖座標），失敗時回傳None
+    """
+    H, W = img.shape[:2]
+    x1, y1 = max(roi[0] // scale, 0), max(roi[1] // scale, 0)
+    x2, y2 = min(-(-roi[2] // scale), W), min(-(-roi[3] // scale), H)
+    sx, sy = seed[0] // scale - x1, seed[1] // scale - y1
+    if not (0 <= sx < x2 - x1 and 0 <= sy < y2 - y1):
+        return None
+
+    mask = flood_fill_mask(img[y1:y2, x1:x2], (sx, sy), tolerance)
+    pts = mask_to_polygon(mask, (sx, sy))
+    if pts is None:
+        return None
+
+    # 轉回原圖座標
+    return (pts + np.array([x1, y1], dtype=np.int32)) * scale
@@ -0,0 +1,134 @@
+import json
+import numpy as np
+import cv2
+import PIL.Image
+import os
+import os.path
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+def split_instances(mask_img: np.ndarray, mode: str, labels: list[str], min_area: int = 1) -> list[dict]:
+    """
+    將一張遮罩圖片依連通區域拆成數個實例
+
+    Args:
+        mask_img: 單通道的遮罩圖片
+        mode: "binary" -> 大於0的像素都算前景；"indexed" -> 像素值i (i >= 1) 代表第i個標籤
+        labels: binary模式下只用到labels[0]；indexed模式下像素值i對應labels[i - 1]，超出範圍則以str(i)當作標籤
+        min_area: 面積小於此值的連通區域會被忽略
+
+    Return:
+        list of { "bbox": [x1, y1, x2, y2], "label": "標籤", "Mask": 二維的int陣列 }
+    """
+    if mode == "binary":
+        layers = [(labels[0], mask_img > 0)]
+    else:
+        values = np.unique(mask_img)
+        values = values[values > 0]
+        layers = [(labels[v - 1] if v - 1 < len(labels) else str(v), mask_img == v) for v in values]
+
+    instances = []
+    for label, fg in layers:
+        n, comp, stats, _ = cv2.connectedComponentsWithStats(fg.astype(np.uint8), connectivity=8)
+
+        # 第0個是背景
+        for k in range(1, n):
+            x, y, w, h, area = stats[k]
+            if area < min_area:
+                continue
+
+            # 在bounding box內取出第k個連通區域，轉成0/255
+            mask = (comp[y : y + h, x : x + w] == k).astype(np.uint8) * 255
+            instances.append({
+                "bbox": [int(x), int(y), int(x + w), int(y + h)], "label": label, "Mask": mask.tolist()
+            })
+
+    return instances
+
+def import_mask_file(MASK_PATH: str, OUT_DIR: str, image_ext: str | None, mode: str, labels: list[str], min_area: int, overwrite: bool) -> tuple[str, int]:
+    """
+    讀取一張遮罩圖片，並輸出和MaskDatabase相容的json檔
+
+    Args:
+        MASK_PATH: 遮罩圖片的路徑
+        OUT_DIR: json檔輸出到哪個資料夾
+        image_ext: 對應的原圖的副檔名（例如".jpg"），None代表和遮罩圖片同名
+
+    Return:
+        (訊息, 實例的數量)
+    """
+    stem, ext = os.path.splitext(os.path.basename(MASK_PATH))
+    img_name = stem + (image_ext if image_ext is not None else ext)
+    JSON_PATH = os.path.join(OUT_DIR, f'{img_name}.json')
+
+    if os.path.exists(JSON_PATH) and not overwrite:
+        return f'略過 {JSON_PATH}（已存在）', 0
+
+    # 用PIL讀取：調色盤（P模式）的png會得到原本的索引值，OpenCV則會把它展開成BGR顏色
+    try:
+        with PIL.Image.open(MASK_PATH) as img:
+            mask_img = np.array(img)
+    except Exception:
+        return f'無法開啟 {MASK_PATH}', 0
+
+    if mask_img.ndim == 3:
+        if mode == "indexed":
+            return f'略過 {MASK_PATH}：indexed模式需要單通道或調色盤的png，這張有 {mask_img.shape[2]} 個通道', 0
+        # binary：任一顏色通道大於0即為前景（不看alpha）
+        colors = 1 if mask_img.shape[2] == 2 else 3
+        mask_img = mask_img[:, :, :colors].max(axis=2)
+
+    instances = split_instances(mask_img, mode, labels, min_area)
+    out_data = { img_name: { str(i): v for i, v in enumerate(instances) } }
+
+    with open(JSON_PATH, 'wt') as f:
+        json.dump(out_data, f)
+
+    return f'寫入 {JSON_PATH}，共 {len(instances)} 個遮罩', len(instances)
+
+def import_masks(MASK_DIR: str, OUT_DIR: str, image_ext: str | None, mode: str, labels: list[str], min_area: int = 1, overwrite: bool = False, workers: int | None = None):
+    """
+    用process pool將 MASK_DIR 下所有的png轉成json檔
+
+    Args:
+        MASK_DIR: 放遮罩圖片的資料夾
+        workers: process的數量，None代表使用所有CPU
+    """
+    mask_paths = sorted(
+        os.path.join(MASK_DIR, name) for name in os.listdir(MASK_DIR) if name.lower().endswith('.png')
+    )
+    os.makedirs(OUT_DIR, exist_ok=True)
+
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        n = len(mask_paths)
+        args = ([OUT_DIR] * n, [image_ext] * n, [mode] * n, [labels] * n, [min_area] * n, [overwrite] * n)
+        for msg, count in pool.map(import_mask_file, mask_paths, *args, chunksize=16):
+            print(msg)
+            total += count
+
+    print(f'完成，{len(mask_paths)} 張圖片，共 {total} 個遮罩')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="將其他工具產生的遮罩圖片（png）依連通區域拆開，轉成本工具的json格式")
+    parser.add_argument("mask_dir", help="放遮罩圖片的資料夾")
+    parser.add_argument("--out-dir", help="json檔輸出的資料夾，預設和mask_dir相同")
+    parser.add_argument("--image-ext", help="對應的原圖的副檔名，例如 .jpg，預設和遮罩圖片同名")
+    parser.add_argument("--mode", choices=["binary", "indexed"], default="binary", help="binary: 大於0即為遮罩；indexed: 像素值i代表第i個標籤")
+    parser.add_argument("--label", action="append", help="標籤，可以指定多次；indexed模式下預設使用 workspace/setting.json 中的 label")
+    parser.add_argument("--min-area", type=int, default=1, help="面積小於此值的連通區域會被忽略")
+    parser.add_argument("--workers", type=int, default=None, help="process的數量，預設使用所有CPU")
+    parser.add_argument("--overwrite", action="store_true", help="覆寫已存在的json檔")
+    args = parser.parse_args()
+
+    labels = args.label
+    if labels is None:
+        if args.mode == "binary":
+            print("binary模式需要用 --label 指定標籤")
+            sys.exit(-1)
+        with open(os.path.join(os.path.dirname(__file__), '..', 'workspace', 'setting.json'), 'rt') as f:
+            labels = json.load(f)['label']
+
+    import_masks(args.mask_dir, args.out_dir or args.mask_dir, args.image_ext, args.mode, labels, args.min_area, args.overwrite, args.workers)
@@ -0,0 +1,181 @@
+import json
+import numpy as np
+import os
+import os.path
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from image_header import read_image_size
+from mask_dataset import find_json
+
+def issue(JSON_PATH: str, key: str | None, code: str, message: str, fixed: bool = False) -> dict:
+    return { "file": JSON_PATH, "key": key, "code": code, "message": message, "fixed": fixed }
+
+def validate_file(JSON_PATH: str, labels: list[str] | None, repair: bool) -> list[dict]:
+    """
+    檢查一個 `{圖片}.json`，若 repair 為 True 則修正可以自動修正的問題，並以atomic的方式寫回
+
+    可以自動修正的問題：
+    - shape_mismatch: Mask 的尺寸和 bbox 不符 -> 以 Mask 的尺寸為準修正 bbox
+    - out_of_image: bbox 超出圖片 -> 將 bbox 和 Mask 裁切到圖片內，裁完為空則刪掉
+    - empty_mask / degenerate_bbox: 刪掉該遮罩
+
+    Return:
+        發現的問題
+    """
+    issues = []
+    basename = os.path.basename(JSON_PATH)[:-len('.json')]
+
+    # 結構 ##################################################################################
+    try:
+        with open(JSON_PATH, 'rt') as f:
+            content = json.load(f)
+    except Exception as e:
+        return [issue(JSON_PATH, None, "invalid_json", repr(e))]
+
+    if not isinstance(content, dict) or basename not in content or not isinstance(content[basename], dict):
+        return [issue(JSON_PATH, None, "missing_image_key", f'沒有包含 "{basename}" 這個key')]
+
+    mask_data = content[basename]
+    keys, bboxes, masks = [], [], []
+    for k, v in mask_data.items():
+        if not (isinstance(v, dict) and isinstance(v.get('bbox'), list) and len(v['bbox']) == 4
+                and all(isinstance(c, int) for c in v['bbox']) and isinstance(v.get('label'), str) and isinstance(v.get('Mask'), list)):
+            issues.append(issue(JSON_PATH, k, "invalid_entry", '缺少 "bbox"（4個整數）、"label"（字串）或 "Mask"（二維陣列）'))
+            continue
+        try:
+            mask = np.array(v['Mask'], dtype=np.uint8)
+            assert mask.ndim == 2
+        except Exception:
+            issues.append(issue(JSON_PATH, k, "ragged_mask", '"Mask" 不是整數二維陣列'))
+            continue
+
+        keys.append(k)
+        bboxes.append(v['bbox'])
+        masks.append(mask)
+
+    if len(issues) != 0 and repair:
+        # 結構有問題的檔案不自動修正，以免丟掉資料
+        repair = False
+
+    # 向量化的檢查 ###########################################################################
+    bboxes = np.array(bboxes, dtype=np.int64).reshape((-1, 4))
+    shapes = np.array([m.shape for m in masks], dtype=np.int64).reshape((-1, 2))  # (h, w)
+    sizes = np.stack((bboxes[:, 3] - bboxes[:, 1], bboxes[:, 2] - bboxes[:, 0]), axis=1)  # (h, w)
+    nonempty = np.array([m.any() for m in masks], dtype=bool)
+
+    mismatch = np.any(shapes != sizes, axis=1)
+    degenerate = np.any(sizes <= 0, axis=1) & ~mismatch
+    empty = ~nonempty
+
+    # 以 Mask 的尺寸為準
+    if repair:
+        bboxes[mismatch, 2] = bboxes[mismatch, 0] + shapes[mismatch, 1]
+        bboxes[mismatch, 3] = bboxes[mismatch, 1] + shapes[mismatch, 0]
+
+    # 圖片的尺寸只讀檔頭（和程式一樣依 EXIF 旋轉）
+    IMG_PATH = JSON_PATH[:-len('.json')]
+    out_of_image = np.zeros(len(keys), dtype=bool)
+    W = H = None
+    if os.path.exists(IMG_PATH):
+        try:
+            W, H = read_image_size(IMG_PATH)
+        except Exception as e:
+            issues.append(issue(JSON_PATH, None, "image_unreadable", f'無法讀取 {IMG_PATH}（{e!r}），略過 out_of_image 檢查'))
+    else:
+        issues.append(issue(JSON_PATH, None, "image_not_found", f'找不到 {IMG_PATH}，略過 out_of_image 檢查'))
+    if W is not None:
+        out_of_image = (bboxes[:, 0] < 0) | (bboxes[:, 1] < 0) | (bboxes[:, 2] > W) | (bboxes[:, 3] > H)
+
+    unknown = np.zeros(len(keys), dtype=bool)
+    if labels is not None:
+        unknown = ~np.isin(np.array([mask_data[k]['label'] for k in keys], dtype=str), np.array(labels, dtype=str))
+
+    # 修正 ##################################################################################
+    keep = np.ones(len(keys), dtype=bool)
+    for i, k in enumerate(keys):
+        if mismatch[i]:
+            issues.append(issue(JSON_PATH, k, "shape_mismatch", f'Mask 的尺寸 {tuple(shapes[i])} 和 bbox 的尺寸 {tuple(sizes[i])} 不符', repair))
+        if degenerate[i]:
+            issues.append(issue(JSON_PATH, k, "degenerate_bbox", f'bbox {bboxes[i].tolist()} 的寬或高不是正數', repair))
+            keep[i] = False
+        if empty[i]:
+            issues.append(issue(JSON_PATH, k, "empty_mask", 'Mask 中沒有任何前景', repair))
+            keep[i] = False
+        if unknown[i]:
+            issues.append(issue(JSON_PATH, k, "unknown_label", f'標籤 "{mask_data[k]["label"]}" 不在 setting.json 中'))
+        if out_of_image[i]:
+            issues.append(issue(JSON_PATH, k, "out_of_image", f'bbox {bboxes[i].tolist()} 超出圖片範圍 {(W, H)}', repair))
+            if repair and keep[i]:
+                x1, y1, x2, y2 = bboxes[i].tolist()
+                cx1, cy1, cx2, cy2 = max(x1, 0), max(y1, 0), min(x2, W), min(y2, H)
+                if cx1 >= cx2 or cy1 >= cy2 or not masks[i][cy1 - y1 : cy2 - y1, cx1 - x1 : cx2 - x1].any():
+                    keep[i] = False
+                else:
+                    masks[i] = masks[i][cy1 - y1 : cy2 - y1, cx1 - x1 : cx2 - x1]
+                    bboxes[i] = (cx1, cy1, cx2, cy2)
+
+    if not repair or not any(x["fixed"] for x in issues):
+        return issues
+
+    # 重新編號，先寫到暫存檔再改名，避免寫到一半時檔案損毀
+    out_data = { basename: dict() }
+    for n, i in enumerate(np.flatnonzero(keep)):
+        k = keys[i]
+        out_data[basename][str(n)] = { "bbox": bboxes[i].tolist(), "label": mask_data[k]['label'], "Mask": masks[i].tolist() }
+
+    TMP_PATH = f'{JSON_PATH}.{os.getpid()}.tmp'
+    with open(TMP_PATH, 'wt') as f:
+        json.dump(out_data, f)
+    os.replace(TMP_PATH, JSON_PATH)
+
+    return issues
+
+def validate_tree(ROOT_DIR: str, labels: list[str] | None, repair: bool = False, workers: int | None = None) -> dict:
+    """
+    用process pool檢查 ROOT_DIR 下所有的標記結果
+
+    Return:
+        { "files": 檢查的檔案數, "summary": { code: 數量 }, "issues": [...] }
+    """
+    paths = find_json(ROOT_DIR)
+    report = { "files": len(paths), "summary": dict(), "issues": [] }
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        n = len(paths)
+        for issues in pool.map(validate_file, paths, [labels] * n, [repair] * n, chunksize=8):
+            for x in issues:
+                report["summary"][x["code"]] = report["summary"].get(x["code"], 0) + 1
+            report["issues"].extend(issues)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="檢查資料夾中所有的標記結果（Mask尺寸、bbox範圍、標籤、空的遮罩），並輸出json格式的報告")
+    parser.add_argument("root_dir", help="放圖片和json的資料夾（會搜尋子資料夾）")
+    parser.add_argument("--report", help="將報告以json輸出到這個檔案，預設只印出摘要")
+    parser.add_argument("--setting", default=os.path.join(os.path.dirname(__file__), '..', 'workspace', 'setting.json'), help="用來檢查標籤的setting.json")
+    parser.add_argument("--repair", action="store_true", help="自動修正可以修正的問題，並覆寫原本的json檔")
+    parser.add_argument("--workers", type=int, default=None, help="process的數量，預設使用所有CPU")
+    args = parser.parse_args()
+
+    labels = None
+    if os.path.exists(args.setting):
+        with open(args.setting, 'rt') as f:
+            labels = json.load(f).get('label')
+
+    report = validate_tree(args.root_dir, labels, args.repair, args.workers)
+
+    print(f'檢查了 {report["files"]} 個檔案')
+    for code, count in sorted(report["summary"].items()):
+        print(f'\t{code}: {count}')
+
+    if args.report is not None:
+        with open(args.report, 'wt') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+
+    # 還有沒修正的問題時回傳1，方便在script中使用
+    sys.exit(1 if any(not x["fixed"] for x in report["issues"]) else 0)